@@ -1,25 +1,112 @@
 import argparse
 import os
-from helper_functions import logging, print_colored, get_int, error, validate_date_format, is_date_greater_or_equal
+from helper_functions import logging, print_colored, get_int, error, get_variant_options_error, validate_date_format, is_date_greater_or_equal
 from datetime import datetime
 
+def add_client_arguments(parser: argparse.ArgumentParser, requests_per_second: float = 5) -> None:
+    parser.add_argument(
+        '--rps',
+        dest='requests_per_second',
+        type=float,
+        default=requests_per_second,
+        help="""
+        Maximum number of requests per second sent to the flights API
+        ex: --rps 2
+        """
+    )
+    parser.add_argument(
+        '--monthly-quota',
+        dest='monthly_quota',
+        type=int,
+        help="""
+        Monthly number of requests allowed by your RapidAPI plan, the run stops once it is used up
+        ex: --monthly-quota 1000
+        """
+    )
+    parser.add_argument(
+        '--cache-backend',
+        dest='cache_backend',
+        choices=['sqlite', 'json'],
+        default='sqlite',
+        help="""
+        Storage used for cached API responses: a single SQLite file or one JSON file per request
+        ex: --cache-backend json
+        """
+    )
+    parser.add_argument(
+        '--backend',
+        dest='backend',
+        choices=['http', 'replay', 'synthetic'],
+        default='http',
+        help="""
+        Where API responses come from: the flights API, responses recorded in a cache folder (see --fixtures),
+        or deterministic generated calendars and flights, which need no credentials
+        ex: --backend replay --fixtures caches
+        """
+    )
+    parser.add_argument(
+        '--fixtures',
+        dest='fixtures',
+        help="""
+        Cache folder replayed by --backend replay, with either cache.sqlite or calendar/flights JSON subfolders
+        ex: --fixtures recorded_caches
+        """
+    )
+    parser.add_argument(
+        '--pool-size',
+        dest='pool_size',
+        type=int,
+        default=10,
+        help="""
+        Number of keep-alive connections kept open to the flights API
+        ex: --pool-size 20
+        """
+    )
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        type=float,
+        default=30,
+        help="""
+        Timeout in seconds for a single request to the flights API
+        ex: --timeout 10
+        """
+    )
+
+def validate_client_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    if args.pool_size < 1:
+        parser.error(f'--pool-size argument({args.pool_size}) must be at least 1')
+
+    if args.requests_per_second <= 0:
+        parser.error(f'--rps argument({args.requests_per_second}) must be greater than 0')
+
+    if args.monthly_quota is not None and args.monthly_quota < 1:
+        parser.error(f'--monthly-quota argument({args.monthly_quota}) must be at least 1')
+
+    if args.backend == 'replay' and not args.fixtures:
+        parser.error('--backend replay requires --fixtures')
+
+    if args.fixtures and not os.path.isdir(args.fixtures):
+        parser.error(f'Folder not found: {args.fixtures}')
+
+    if args.timeout <= 0:
+        parser.error(f'--timeout argument({args.timeout}) must be greater than 0')
+
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '--leave',
         dest='start_date',
-        required=True,
         help="""
-        Earliest departure date in format YYYY-MM-DD
+        Earliest departure date in format YYYY-MM-DD, required unless every --batch entry has its own
         ex: --leave 2025-05-02
         """
     )
     parser.add_argument(
         '--return',
         dest='end_date',
-        required=True,
         help="""
-        Latest return date in format YYYY-MM-DD
+        Latest return date in format YYYY-MM-DD, required unless every --batch entry has its own
         ex: --leave 2025-05-25
         """
     )
@@ -31,18 +118,175 @@ def parse_arguments():
         ex: --itinerary itinerary.json
         """
     )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help="""
+        Continue the plan saved in checkpoint.jsonl by an earlier run with the same --leave and --return,
+        skipping the price calendars, flight searches and results it already completed
+        ex: --resume
+        """
+    )
+    parser.add_argument(
+        '--batch',
+        dest='batch',
+        help="""
+        Plan several itineraries in one run: a folder of itinerary files, or a JSON manifest listing
+        {"itinerary": path, "name", "leave", "return", "adults", "stops"} entries (all but itinerary optional,
+        defaulting to the command line). Calendars and flight searches shared by plans are fetched once
+        ex: --batch trips/
+        """
+    )
+    parser.add_argument(
+        '--output-dir',
+        dest='output_dir',
+        default='results',
+        help="""
+        Folder receiving one result file per --batch plan, named after the plan
+        ex: --output-dir batch_results
+        """
+    )
+    parser.add_argument(
+        '--adults',
+        dest='adults',
+        type=int,
+        nargs='+',
+        default=[1],
+        help="""
+        Number of adult passengers, several values run one search per group size
+        ex: --adults 1 2 4
+        """
+    )
+    parser.add_argument(
+        '--stops',
+        dest='stops',
+        nargs='+',
+        default=['direct'],
+        help="""
+        Allowed stops as accepted by the flights API (direct, 1stop, 2stops or a comma separated combination),
+        several values run one search per option
+        ex: --stops direct direct,1stop
+        """
+    )
+    parser.add_argument(
+        '--top',
+        dest='top',
+        type=int,
+        default=10,
+        help="""
+        Number of cheapest itineraries to write to the result
+        ex: --top 20
+        """
+    )
+    parser.add_argument(
+        '--lazy',
+        dest='lazy',
+        action='store_true',
+        help="""
+        Use the calendar prices as estimates and only search the dates of itineraries that can still reach the --top cheapest
+        ex: --lazy
+        """
+    )
+    parser.add_argument(
+        '--stream',
+        dest='stream',
+        action='store_true',
+        help="""
+        Append every itinerary to final_result.jsonl as soon as it is found, rewrite final_result.json
+        with the --top cheapest so far every few seconds and print the progress. Needs --lazy, the only
+        mode finding itineraries while flights are still searched
+        ex: --lazy --stream
+        """
+    )
+    parser.add_argument(
+        '--engine',
+        dest='engine',
+        choices=['search', 'numpy'],
+        default='search',
+        help="""
+        How the fetched prices are combined into ranked itineraries: a best-first path search,
+        or date x leg price matrices with NumPy (requires numpy, cannot be combined with --lazy)
+        ex: --engine numpy
+        """
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=8,
+        help="""
+        Maximum number of flight searches fetched concurrently
+        ex: --workers 4
+        """
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help="""
+        Fetch flight searches with the asyncio client, polling incomplete searches with backoff
+        ex: --async
+        """
+    )
+    parser.add_argument(
+        '--estimate',
+        dest='estimate',
+        action='store_true',
+        help="""
+        Only report an upper bound of the flight searches not cached yet, without running them (polling is extra)
+        ex: --estimate
+        """
+    )
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        help="""
+        Print where wall time and API requests were spent and write the phase timings, per endpoint counters
+        and latency histograms to this JSON file, which also opens as a trace in chrome://tracing or Perfetto
+        ex: --profile profile.json
+        """
+    )
+    add_client_arguments(parser)
 
     args = parser.parse_args()
+    if not args.batch and (not args.start_date or not args.end_date):
+        parser.error('the following arguments are required: --leave, --return')
+
     for date in args.start_date, args.end_date:
+        if date is None:
+            continue
         if not validate_date_format(date, '%Y-%m-%d'):
             parser.error(f'{date} does not respect the correct format "YYYY-MM-DD"')
         
         if not is_date_greater_or_equal(date):
             parser.error(f'Invalid date: {date}. Please enter a date that is today or in the future.')
-    if not is_date_greater_or_equal(args.end_date, args.start_date):
+    if args.start_date and args.end_date and not is_date_greater_or_equal(args.end_date, args.start_date):
         parser.error(f'--return argument({args.end_date}) is earlier than --leave argument({args.start_date})')
         
     if args.itinerary and not os.path.isfile(args.itinerary):
         parser.error(f'File not found: {args.itinerary}')
 
+    if args.batch:
+        if not os.path.exists(args.batch):
+            parser.error(f'File or folder not found: {args.batch}')
+        if args.itinerary or args.resume:
+            parser.error('--batch cannot be combined with --itinerary or --resume')
+
+    if message := get_variant_options_error(args.adults, args.stops):
+        parser.error(f'--{message}')
+
+    if args.stream and not args.lazy:
+        parser.error('--stream requires --lazy, without it every search finishes before the first itinerary is found')
+    if args.lazy and args.engine == 'numpy':
+        parser.error('--engine numpy cannot be combined with --lazy, the lazy search ranks while it searches')
+
+    if args.top < 1:
+        parser.error(f'--top argument({args.top}) must be at least 1')
+
+    if args.workers < 1:
+        parser.error(f'--workers argument({args.workers}) must be at least 1')
+
+    validate_client_arguments(parser, args)
+
     return args
\ No newline at end of file
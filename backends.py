@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import random
+import threading
+from datetime import date, datetime, time, timedelta
+from time import sleep
+import requests
+from requests.adapters import HTTPAdapter
+from cache import CacheManager, JsonCacheBackend, SqliteCacheBackend
+from scheduler import RequestScheduler, QuotaCounter
+from helper_functions import logging, error
+from instrumentation import instrumentation
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+
+class ApiBackend:
+    quota: QuotaCounter | None = None
+
+    def send(self, endpoint: str, params: dict[str, object]) -> dict[str, object]:
+        raise NotImplementedError
+
+class HttpBackend(ApiBackend):
+    def __init__(self, pool_size: int = 10, timeout: float = 30, requests_per_second: float = 5, monthly_quota: int | None = None):
+        try:
+            with open(f'{cwd}/credentials.json') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            error(f'Please create credentials.json in this folder: {cwd}', 'Or plan offline with --backend replay or --backend synthetic')
+
+        try:
+            self.url: str = data['url']
+            self.credentials = {'x-rapidapi-key': data['x-rapidapi-key'], 'x-rapidapi-host': data['x-rapidapi-host']}
+        except KeyError:
+            error('One of the required fields is missing in credentials.json: url, x-rapidapi-key, x-rapidapi-host')
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(self.credentials)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.scheduler = RequestScheduler(
+            quota_path=os.path.join(CacheManager.cache_dir, 'quota.json'),
+            requests_per_second=requests_per_second,
+            monthly_quota=monthly_quota
+        )
+        self.quota = self.scheduler.quota
+
+    def send(self, endpoint: str, params: dict[str, object]) -> dict[str, object]:
+        try:
+            response = self.scheduler.send(lambda: self.session.get(self.url + endpoint, params=params, timeout=self.timeout), endpoint)
+            instrumentation.increment(endpoint, 'bytes', len(response.content))
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 429:
+                error(f'HTTP error occurred: {e}', f'Still rate limited after {self.scheduler.max_retries} retries, please lower --rps or check the monthly requests quota')
+            error(f'HTTP error occurred: {e}', f'Please make sure your credentials are correct and you have not exceeded the monthly requests quota')
+        except requests.exceptions.RequestException as e:
+            error(f'An error occurred: {e}')
+        return response.json()
+
+def get_empty_response(endpoint: str) -> dict[str, object]:
+    if endpoint == CacheManager.endpoints_by_subdir['calendar']:
+        return {'data': {'PriceGrids': {'Grid': []}, 'Traces': {}}}
+    if endpoint == CacheManager.endpoints_by_subdir['flights']:
+        return {'data': {'context': {'sessionId': '', 'status': 'complete'}, 'itineraries': []}}
+    return {'data': []}
+
+class ReplayBackend(ApiBackend):
+    def __init__(self, fixtures_dir: str, latency: float = 0):
+        if not os.path.isdir(fixtures_dir):
+            error(f'Fixtures folder not found: {fixtures_dir}')
+        self.latency = latency
+        # Recorded caches are replayed as they are, even after they expired.
+        if os.path.exists(os.path.join(fixtures_dir, 'cache.sqlite')):
+            self.fixtures = SqliteCacheBackend(fixtures_dir, read_only=True)
+        else:
+            self.fixtures = JsonCacheBackend(fixtures_dir)
+        self.fixtures_dir = fixtures_dir
+        self.subdirs_by_endpoint = {endpoint: subdir for subdir, endpoint in CacheManager.endpoints_by_subdir.items() if subdir != 'debug'}
+        self.missing = 0
+        self.lock = threading.Lock()
+
+    def send(self, endpoint: str, params: dict[str, object]) -> dict[str, object]:
+        sleep(self.latency)
+        data = self.fixtures.get(self.subdirs_by_endpoint.get(endpoint, ''), endpoint, CacheManager.get_key(params), include_expired=True)
+        if data is None:
+            with self.lock:
+                self.missing += 1
+            instrumentation.increment(endpoint, 'missing')
+            return get_empty_response(endpoint)
+        return data
+
+    def warn_missing(self) -> None:
+        if self.missing:
+            logging.warning(f'{self.missing} requests were not recorded in {self.fixtures_dir} and got empty results, the plan may miss flights')
+
+class SyntheticBackend(ApiBackend):
+    def __init__(self, seed: str = 'holiday-planner', latency: float = 0):
+        self.seed = seed
+        self.latency = latency
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def get_random(self, *values: object) -> random.Random:
+        return random.Random(hashlib.sha256('|'.join(map(str, (self.seed, *values))).encode()).digest())
+
+    def get_itineraries(self, from_entity: str, to_entity: str, day: date, adults: int) -> list[dict[str, object]]:
+        rng = self.get_random(from_entity, to_entity, day)
+        itineraries = []
+        for _ in range(rng.randint(0, 4)):
+            departure = datetime.combine(day, time()) + timedelta(minutes=rng.randrange(24 * 60))
+            arrival = departure + timedelta(minutes=rng.randint(45, 300))
+            itineraries.append({
+                'price': {'raw': float(rng.randint(30, 330) * int(adults))},
+                'legs': [{'departure': departure.strftime('%Y-%m-%dT%H:%M:%S'), 'arrival': arrival.strftime('%Y-%m-%dT%H:%M:%S')}]
+            })
+        return itineraries
+
+    def get_calendar(self, from_entity: str, to_entity: str, year_month: str) -> dict[str, object]:
+        year, month = map(int, year_month.split('-'))
+        day = date(year, month, 1)
+        row, traces = [], {}
+        while day.month == month:
+            cell = {}
+            itineraries = self.get_itineraries(from_entity, to_entity, day, 1)
+            if itineraries:
+                # The calendar price is never above the searched prices, like a cached lowest fare.
+                traces[f'd{day.day}'] = f'*{from_entity}*{to_entity}*d*{day:%Y%m%d}*'
+                cell['Direct'] = {'Price': min(itinerary['price']['raw'] for itinerary in itineraries), 'TraceRefs': [f'd{day.day}']}
+            traces[f'i{day.day}'] = f'*{from_entity}*{to_entity}*i*{day:%Y%m%d}*'
+            cell['Indirect'] = {'Price': float(self.get_random(from_entity, to_entity, day, 'indirect').randint(20, 200)), 'TraceRefs': [f'i{day.day}']}
+            row.append(cell)
+            day += timedelta(days=1)
+        return {'data': {'PriceGrids': {'Grid': [row]}, 'Traces': traces}}
+
+    def send(self, endpoint: str, params: dict[str, object]) -> dict[str, object]:
+        sleep(self.latency)
+        with self.lock:
+            self.sent += 1
+        if endpoint == CacheManager.endpoints_by_subdir['calendar']:
+            return self.get_calendar(params['fromEntityId'], params['toEntityId'], params['yearMonth'])
+        if endpoint == CacheManager.endpoints_by_subdir['flights']:
+            day = date.fromisoformat(params['departDate'])
+            itineraries = self.get_itineraries(params['fromEntityId'], params['toEntityId'], day, params['adults'])
+            return {'data': {'context': {'sessionId': '', 'status': 'complete'}, 'itineraries': itineraries}}
+        return get_empty_response(endpoint)
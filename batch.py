@@ -0,0 +1,96 @@
+import json
+import os
+from cache import CacheManager
+from flights_api import FlightsApi
+from helper_functions import GREEN, print_colored, error, map_concurrently, to_list, get_variant_options_error, validate_date_format, is_date_greater_or_equal, validate_itinerary_stay_limits
+from models import PlanOptions
+from planner import mutate_itinerary_with_possible_flight_dates, report_planned_requests, get_calendar_queries, fetch_calendar_prices, build_legs, get_flight_requests, get_variants, get_variant_path, get_variant_suffix, rank_variants
+
+def load_batch(path: str, args: object) -> list[dict[str, object]]:
+    if os.path.isdir(path):
+        entries = [{'itinerary': file_name} for file_name in sorted(os.listdir(path)) if file_name.endswith('.json')]
+        base_dir = path
+    else:
+        with open(path) as f:
+            entries = json.load(f)
+        base_dir = os.path.dirname(path)
+    if not entries:
+        error(f'No itineraries found in {path}')
+
+    plans = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get('itinerary'), str):
+            error(f'Batch entry {index} must be a JSON object with an "itinerary" path')
+        itinerary_path = os.path.join(base_dir, entry['itinerary'])
+        name = entry.get('name') or os.path.splitext(os.path.basename(itinerary_path))[0]
+        # The name becomes the result file name, which must stay inside --output-dir.
+        if not isinstance(name, str) or name in ('.', '..') or any(separator and separator in name for separator in ('/', os.sep, os.altsep)):
+            error(f'Batch entry {index}: name {name!r} must be a file name without path separators')
+        plan = {
+            'name': name,
+            'start_date': entry.get('leave', args.start_date),
+            'end_date': entry.get('return', args.end_date),
+            'adults': to_list(entry.get('adults', args.adults)),
+            'stops': to_list(entry.get('stops', args.stops))
+        }
+        if message := get_variant_options_error(plan['adults'], plan['stops']):
+            error(f'{name}: {message}')
+        for date in plan['start_date'], plan['end_date']:
+            if not date:
+                error(f'{name}: no date window, give leave and return in the manifest or use --leave and --return')
+            if not isinstance(date, str) or not validate_date_format(date, '%Y-%m-%d') or not is_date_greater_or_equal(date):
+                error(f'{name}: {date} is not a date in format "YYYY-MM-DD" that is today or in the future')
+        if not is_date_greater_or_equal(plan['end_date'], plan['start_date']):
+            error(f'{name}: return({plan["end_date"]}) is earlier than leave({plan["start_date"]})')
+        try:
+            with open(itinerary_path) as f:
+                plan['itinerary'] = json.load(f)
+        except FileNotFoundError:
+            error(f'{name}: file not found: {itinerary_path}')
+        validate_itinerary_stay_limits(
+            start_date=plan['start_date'],
+            end_date=plan['end_date'],
+            max_duration=sum([leg['max_stay_duration'] or 0 for leg in plan['itinerary']])
+        )
+        mutate_itinerary_with_possible_flight_dates(plan['itinerary'], plan['start_date'], plan['end_date'])
+        plans.append(plan)
+    if len({plan['name'] for plan in plans}) < len(plans):
+        error('Several plans in the batch have the same name, their results would overwrite each other')
+    return plans
+
+def get_unique_requests(requests: list[dict[str, object]]) -> list[dict[str, object]]:
+    return list({(request['endpoint'], CacheManager.get_key(request['params'])): request for request in requests}.values())
+
+def rank_plan(plan: dict[str, object], options: PlanOptions, output_dir: str) -> list[str]:
+    summaries = []
+    variants = get_variants(plan['adults'], plan['stops'])
+    output_path = os.path.join(output_dir, f'{plan["name"]}.json')
+    for (adults, stops), complete_itineraries in rank_variants(plan['legs_by_stops'], variants, options, output_path).items():
+        with open(get_variant_path(output_path, get_variant_suffix(adults, stops, variants)), 'w') as f:
+            json.dump(complete_itineraries, f, indent=4)
+        best = f'cheapest total {complete_itineraries[0]["total"]}' if complete_itineraries else 'no itineraries found'
+        summaries.append(f'{plan["name"]}, {adults} adults, {stops}: {best}')
+    return summaries
+
+def run_batch(args: object) -> None:
+    plans = load_batch(args.batch, args)
+    # Plans sharing routes and months share their calendar requests.
+    calendar_queries = list(dict.fromkeys(query for plan in plans for query in get_calendar_queries(plan['itinerary'], plan['stops'])))
+    report_planned_requests(f'Price calendars of {len(plans)} plans', get_unique_requests([FlightsApi.calendar_request(*query[:3]) for query in calendar_queries]))
+    calendar_prices_by_query = fetch_calendar_prices(calendar_queries, args.workers)
+    for plan in plans:
+        plan['legs_by_stops'] = {stops: build_legs(plan['itinerary'], calendar_prices_by_query, stops) for stops in plan['stops']}
+
+    report_planned_requests(f'Flight searches of {len(plans)} plans', get_unique_requests([
+        request for plan in plans for adults, stops in get_variants(plan['adults'], plan['stops'])
+        for request in get_flight_requests(plan['legs_by_stops'][stops], adults, stops)
+    ]))
+    if args.estimate:
+        return
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = PlanOptions.from_args(args)
+    # Concurrent plans go through the same client, so a search needed by several plans is sent once.
+    # Async searches are only shared within an event loop, so --async plans run one after another.
+    for summaries in map_concurrently(lambda plan: rank_plan(plan, options, args.output_dir), plans, 1 if options.use_async else args.workers):
+        for summary in summaries:
+            print_colored(GREEN, summary)
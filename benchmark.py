@@ -0,0 +1,272 @@
+import argparse
+import contextlib
+import copy
+import io
+import itertools
+import json
+import os
+import statistics
+import tempfile
+from datetime import date, datetime, timedelta
+from backends import ApiBackend, ReplayBackend, SyntheticBackend
+from cache import CacheManager
+from flights_api import FlightsApi, AsyncFlightsApi
+from helper_functions import GREEN, YELLOW, print_colored, error
+from instrumentation import instrumentation
+from models import PlanOptions
+from planner import mutate_itinerary_with_possible_flight_dates, get_calendar_queries, fetch_calendar_prices, build_legs, rank_variants
+
+CITIES = ['BUH', 'BCN', 'ROME', 'PAR', 'BER', 'VIE', 'MAD', 'AMS', 'LIS', 'ATH']
+PHASES = ['dates', 'calendar', 'fetch', 'ranking']
+# With --lazy, searching and ranking interleave and are all reported as fetch.
+SPANS_BY_PHASE = {'dates': ['dates'], 'calendar': ['calendar'], 'fetch': ['fetch flights', 'lazy search'], 'ranking': ['rank']}
+
+def create_synthetic_itinerary(legs: int, min_stay_duration: int = 2, max_stay_duration: int = 4) -> list[dict[str, str | int | bool | None]]:
+    itinerary = []
+    for index in range(legs):
+        final_destination = index == legs - 1
+        itinerary.append({
+            'fromEntityId': CITIES[index % len(CITIES)],
+            'toEntityId': CITIES[0] if final_destination else CITIES[(index + 1) % len(CITIES)],
+            'final_destination': final_destination,
+            'min_stay_duration': None if final_destination else min_stay_duration,
+            'max_stay_duration': None if final_destination else max_stay_duration,
+            'min_departure_hour': '00:00:00',
+            'max_departure_hour': '23:59:59'
+        })
+    return itinerary
+
+def reset_client(cache_dir: str, latency: float, fixtures: str | None = None) -> ApiBackend:
+    # Every run starts cold: empty cache, fresh clients and empty memoized lookups.
+    CacheManager.cache_dir = cache_dir
+    CacheManager.use_backend('sqlite')
+    FlightsApi._instances.clear()
+    for client in (FlightsApi, AsyncFlightsApi):
+        client.get_flights_for_date.cache.clear()
+        client.get_flight_prices_by_route.cache.clear()
+    backend = ReplayBackend(fixtures, latency) if fixtures else SyntheticBackend(latency=latency)
+    FlightsApi.get_instance(backend=backend)
+    AsyncFlightsApi.get_instance(backend=backend)
+    return backend
+
+def run_case(itinerary: list[dict[str, str | int | bool | None]], start_date: date, window: int, options: PlanOptions, latency: float, fixtures: str | None = None) -> dict[str, float | int]:
+    end_date = start_date + timedelta(days=window)
+    itinerary = copy.deepcopy(itinerary)
+    with tempfile.TemporaryDirectory() as cache_dir, contextlib.redirect_stdout(io.StringIO()):
+        reset_client(cache_dir, latency, fixtures)
+        instrumentation.reset()
+        # The same planner functions and spans as a planning run, so lazy search and every ranking change are timed too.
+        with instrumentation.span('dates'):
+            mutate_itinerary_with_possible_flight_dates(itinerary, start_date.isoformat(), end_date.isoformat())
+        with instrumentation.span('calendar'):
+            legs_by_stops = {'direct': build_legs(itinerary, fetch_calendar_prices(get_calendar_queries(itinerary, ['direct']), options.workers), 'direct')}
+        results = rank_variants(legs_by_stops, [(1, 'direct')], options)[(1, 'direct')]
+    summary = instrumentation.summary()
+    timings = {phase: sum(summary['phases'].get(span, {}).get('seconds', 0.0) for span in SPANS_BY_PHASE[phase]) for phase in PHASES}
+    timings['requests'] = sum(counters['requests'] for counters in summary['endpoints'].values())
+    timings['missing'] = sum(counters['missing'] for counters in summary['endpoints'].values())
+    timings['results'] = len(results)
+    return timings
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Time the planning phases on synthetic itineraries or recorded caches, without API credentials')
+    parser.add_argument(
+        '--legs',
+        dest='legs',
+        type=int,
+        nargs='+',
+        default=[2, 3, 4],
+        help="""
+        Number of legs of the generated round trips
+        ex: --legs 2 4 6
+        """
+    )
+    parser.add_argument(
+        '--windows',
+        dest='windows',
+        type=int,
+        nargs='+',
+        default=[30, 60, 120],
+        help="""
+        Number of days between --leave and --return
+        ex: --windows 30 90
+        """
+    )
+    parser.add_argument(
+        '--fixtures',
+        dest='fixtures',
+        help="""
+        Replay this recorded cache folder instead of generating responses, with either cache.sqlite or calendar/flights JSON subfolders
+        ex: --fixtures caches
+        """
+    )
+    parser.add_argument(
+        '--itinerary',
+        dest='itinerary',
+        help="""
+        Plan this itinerary file instead of generated round trips, for example the routes of --fixtures (--legs is then ignored)
+        ex: --itinerary itinerary.json
+        """
+    )
+    parser.add_argument(
+        '--leave',
+        dest='start_date',
+        type=date.fromisoformat,
+        default=datetime.now().date() + timedelta(days=30),
+        help="""
+        First day of every window, in format YYYY-MM-DD, 30 days from today by default
+        ex: --leave 2025-05-02
+        """
+    )
+    parser.add_argument(
+        '--repeat',
+        dest='repeat',
+        type=int,
+        default=3,
+        help="""
+        Runs per case, the median of each phase is reported
+        ex: --repeat 5
+        """
+    )
+    parser.add_argument(
+        '--latency',
+        dest='latency',
+        type=float,
+        default=0,
+        help="""
+        Simulated seconds per API request
+        ex: --latency 0.05
+        """
+    )
+    parser.add_argument(
+        '--top',
+        dest='top',
+        type=int,
+        default=10,
+        help="""
+        Number of cheapest itineraries ranked
+        ex: --top 100
+        """
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=8,
+        help="""
+        Maximum number of flight searches fetched concurrently
+        ex: --workers 4
+        """
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help="""
+        Fetch flight searches with the asyncio client
+        ex: --async
+        """
+    )
+    parser.add_argument(
+        '--lazy',
+        dest='lazy',
+        action='store_true',
+        help="""
+        Time the lazy search, which only searches the dates that can still reach --top
+        ex: --lazy
+        """
+    )
+    parser.add_argument(
+        '--engine',
+        dest='engine',
+        choices=['search', 'numpy'],
+        default='search',
+        help="""
+        Ranking engine
+        ex: --engine numpy
+        """
+    )
+    parser.add_argument(
+        '--output',
+        dest='output',
+        help="""
+        Write the timings to a JSON file, usable later as --baseline
+        ex: --output benchmark.json
+        """
+    )
+    parser.add_argument(
+        '--baseline',
+        dest='baseline',
+        help="""
+        Fail if a phase got slower than in this earlier --output file by more than --tolerance
+        ex: --baseline benchmark.json
+        """
+    )
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        type=float,
+        default=0.5,
+        help="""
+        Allowed relative slowdown compared to --baseline
+        ex: --tolerance 0.2
+        """
+    )
+    args = parser.parse_args()
+    if args.fixtures and not os.path.isdir(args.fixtures):
+        parser.error(f'Folder not found: {args.fixtures}')
+    if args.itinerary and not os.path.isfile(args.itinerary):
+        parser.error(f'File not found: {args.itinerary}')
+    if any(legs < 2 for legs in args.legs):
+        parser.error('--legs values must be at least 2')
+    if args.lazy and args.engine == 'numpy':
+        parser.error('--engine numpy cannot be combined with --lazy, the lazy search ranks while it searches')
+    if args.repeat < 1:
+        parser.error(f'--repeat argument({args.repeat}) must be at least 1')
+    return args
+
+def get_regressions(timings: dict[str, dict[str, float | int]], baseline: dict[str, dict[str, float | int]], tolerance: float, min_seconds: float = 0.01) -> list[str]:
+    regressions = []
+    for case, phases in timings.items():
+        if case not in baseline:
+            continue
+        if phases['requests'] > baseline[case]['requests']:
+            regressions.append(f'{case}: {phases["requests"]} API requests, baseline {baseline[case]["requests"]}')
+        for phase in PHASES:
+            allowed = max(baseline[case][phase], min_seconds) * (1 + tolerance)
+            if phases[phase] > allowed:
+                regressions.append(f'{case} {phase}: {phases[phase]:.3f}s, baseline {baseline[case][phase]:.3f}s')
+    return regressions
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    options = PlanOptions(top=args.top, workers=args.workers, use_async=args.use_async, lazy=args.lazy, engine=args.engine)
+    if args.itinerary:
+        with open(args.itinerary) as f:
+            itinerary = json.load(f)
+        itineraries = {len(itinerary): itinerary}
+    else:
+        itineraries = {legs: create_synthetic_itinerary(legs) for legs in args.legs}
+    timings = {}
+    print(f'{"legs":>4} {"days":>5} {"requests":>8} ' + ' '.join(f'{phase:>9}' for phase in PHASES))
+    for legs, window in itertools.product(itineraries, args.windows):
+        if window < sum(leg['min_stay_duration'] or 0 for leg in itineraries[legs]):
+            print_colored(YELLOW, f'Skipping {legs} legs in {window} days, the minimum stays do not fit')
+            continue
+        runs = [run_case(itineraries[legs], args.start_date, window, options, args.latency, args.fixtures) for _ in range(args.repeat)]
+        case = {phase: statistics.median(run[phase] for run in runs) for phase in PHASES}
+        case.update(requests=runs[0]['requests'], results=runs[0]['results'], missing=runs[0]['missing'])
+        timings[f'{legs}_legs_{window}_days'] = case
+        print(f'{legs:>4} {window:>5} {case["requests"]:>8} ' + ' '.join(f'{case[phase]:>8.3f}s' for phase in PHASES))
+        if case['missing']:
+            print_colored(YELLOW, f'{case["missing"]} requests had no recorded response, the timings cover fewer results')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(timings, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = get_regressions(timings, json.load(f), args.tolerance)
+        if regressions:
+            error('Slower than the baseline:', *regressions)
+        print_colored(GREEN, f'No phase is more than {args.tolerance:.0%} slower than {args.baseline}')
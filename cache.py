@@ -0,0 +1,381 @@
+import argparse
+import atexit
+import functools
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from helper_functions import print_colored
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+
+GREEN = 32
+
+class CacheBackend:
+    def get(self, subdir: str, endpoint: str, key: str, include_expired: bool = False) -> dict[str, object] | None:
+        raise NotImplementedError
+
+    def store(self, subdir: str, endpoint: str, key: str, data: dict[str, object], expiration: timedelta, params: dict[str, object] | None = None, force: bool = False) -> None:
+        raise NotImplementedError
+
+    def get_expires_at(self, subdir: str, endpoint: str, key: str) -> datetime | None:
+        raise NotImplementedError
+
+    def evict_expired(self) -> int:
+        raise NotImplementedError
+
+class JsonCacheBackend(CacheBackend):
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def get_path(self, subdir: str, key: str) -> str:
+        return os.path.join(self.cache_dir, subdir, f'{key}.json')
+
+    def check_cache_valid(self, path: str) -> bool:
+        dir_name = os.path.basename(os.path.dirname(path))
+        return datetime.now() - datetime.fromtimestamp(os.path.getmtime(path)) < CacheManager.cache_expirations_by_subdir[dir_name]
+
+    def get(self, subdir: str, endpoint: str, key: str, include_expired: bool = False) -> dict[str, object] | None:
+        path = self.get_path(subdir, key)
+        if os.path.exists(path) and (include_expired or self.check_cache_valid(path)):
+            with open(path) as f:
+                return json.load(f)
+        return
+
+    def store(self, subdir: str, endpoint: str, key: str, data: dict[str, object], expiration: timedelta, params: dict[str, object] | None = None, force: bool = False) -> None:
+        path = self.get_path(subdir, key)
+        if force or not os.path.exists(path) or not self.check_cache_valid(path):
+            os.makedirs(os.path.dirname(path), mode=0o750, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(data, f, indent=4)
+
+    def get_expires_at(self, subdir: str, endpoint: str, key: str) -> datetime | None:
+        path = self.get_path(subdir, key)
+        if not os.path.exists(path):
+            return None
+        return datetime.fromtimestamp(os.path.getmtime(path)) + CacheManager.cache_expirations_by_subdir[subdir]
+
+    def iter_entries(self) -> iter:
+        for subdir, endpoint in CacheManager.endpoints_by_subdir.items():
+            directory = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                path = os.path.join(directory, file_name)
+                if file_name.endswith('.json') and self.check_cache_valid(path):
+                    yield subdir, endpoint, file_name[:-len('.json')], path
+
+    def evict_expired(self) -> int:
+        evicted = 0
+        for subdir in CacheManager.endpoints_by_subdir:
+            directory = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                path = os.path.join(directory, file_name)
+                if file_name.endswith('.json') and not self.check_cache_valid(path):
+                    os.remove(path)
+                    evicted += 1
+        return evicted
+
+class SqliteCacheBackend(CacheBackend):
+    def __init__(self, cache_dir: str, file_name: str = 'cache.sqlite', read_only: bool = False, access_flush_size: int = 256):
+        self.path = os.path.join(cache_dir, file_name)
+        self.lock = threading.Lock()
+        self.read_only = read_only
+        self.access_flush_size = access_flush_size
+        self.pending_accesses: dict[tuple[str, str, str], tuple[int, float]] = {}
+        if read_only:
+            # Recorded fixtures are replayed without migrating or touching them.
+            self.connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            return
+        os.makedirs(cache_dir, mode=0o750, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        atexit.register(self.flush_accesses)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    subdir TEXT NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (subdir, endpoint, key)
+                )
+            ''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)')
+            # Added for prefetching: the original request params and how often an entry is read.
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(cache)')}
+            for column, definition in [('params', 'TEXT'), ('hits', 'INTEGER NOT NULL DEFAULT 0'), ('accessed_at', 'REAL')]:
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE cache ADD COLUMN {column} {definition}')
+
+    @staticmethod
+    def serialize(data: dict[str, object]) -> bytes:
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+
+    @staticmethod
+    def deserialize(data: bytes) -> dict[str, object]:
+        return json.loads(zlib.decompress(data))
+
+    def get(self, subdir: str, endpoint: str, key: str, include_expired: bool = False) -> dict[str, object] | None:
+        now = datetime.now().timestamp()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT data FROM cache WHERE subdir = ? AND endpoint = ? AND key = ? AND expires_at > ?',
+                (subdir, endpoint, key, float('-inf') if include_expired else now)
+            ).fetchone()
+            if row and not self.read_only:
+                # Reads stay read only, the access counts are written in batches.
+                hits, _ = self.pending_accesses.get((subdir, endpoint, key), (0, now))
+                self.pending_accesses[(subdir, endpoint, key)] = (hits + 1, now)
+                if len(self.pending_accesses) >= self.access_flush_size:
+                    self._flush_accesses()
+        return self.deserialize(row[0]) if row else None
+
+    def _flush_accesses(self) -> None:
+        if not self.pending_accesses:
+            return
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE cache SET hits = hits + ?, accessed_at = ? WHERE subdir = ? AND endpoint = ? AND key = ?',
+                [(hits, accessed_at, *entry) for entry, (hits, accessed_at) in self.pending_accesses.items()]
+            )
+        self.pending_accesses.clear()
+
+    def flush_accesses(self) -> None:
+        with self.lock:
+            self._flush_accesses()
+
+    def store(self, subdir: str, endpoint: str, key: str, data: dict[str, object], expiration: timedelta, params: dict[str, object] | None = None, force: bool = False, created_at: datetime | None = None) -> None:
+        created_at = created_at or datetime.now()
+        with self.lock, self.connection:
+            self.connection.execute(
+                f'''
+                INSERT INTO cache (subdir, endpoint, key, data, created_at, expires_at, params, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (subdir, endpoint, key) DO UPDATE SET
+                    data = excluded.data, created_at = excluded.created_at, expires_at = excluded.expires_at,
+                    params = coalesce(excluded.params, cache.params)
+                {'' if force else 'WHERE cache.expires_at <= excluded.created_at'}
+                ''',
+                (
+                    subdir, endpoint, key, self.serialize(data), created_at.timestamp(), (created_at + expiration).timestamp(),
+                    None if params is None else json.dumps(params), created_at.timestamp()
+                )
+            )
+
+    def get_expires_at(self, subdir: str, endpoint: str, key: str) -> datetime | None:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT expires_at FROM cache WHERE subdir = ? AND endpoint = ? AND key = ?', (subdir, endpoint, key)
+            ).fetchone()
+        return datetime.fromtimestamp(row[0]) if row else None
+
+    def get_accessed_entries(self, since: datetime) -> list[tuple[str, str, dict[str, object], int]]:
+        with self.lock:
+            self._flush_accesses()
+            rows = self.connection.execute(
+                '''
+                SELECT subdir, endpoint, params, hits FROM cache
+                WHERE params IS NOT NULL AND coalesce(accessed_at, created_at) >= ?
+                ORDER BY hits DESC
+                ''',
+                (since.timestamp(),)
+            ).fetchall()
+        return [(subdir, endpoint, json.loads(params), hits) for subdir, endpoint, params, hits in rows]
+
+    def evict_expired(self) -> int:
+        with self.lock, self.connection:
+            return self.connection.execute('DELETE FROM cache WHERE expires_at <= ?', (datetime.now().timestamp(),)).rowcount
+
+    def vacuum(self) -> None:
+        with self.lock:
+            self.connection.execute('VACUUM')
+
+class CacheManager:
+    cache_expirations_by_subdir = {
+        'calendar': timedelta(days=3),
+        'location_ids': timedelta(days=30),
+        'flights': timedelta(days=7),
+        'debug': timedelta(days=100)
+    }
+    endpoints_by_subdir = {
+        'calendar': '/flights/price-calendar-web',
+        'location_ids': '/flights/auto-complete',
+        'flights': '/flights/search-one-way',
+        'debug': '/flights/search-one-way'
+    }
+    backends = {
+        'json': JsonCacheBackend,
+        'sqlite': SqliteCacheBackend
+    }
+    cache_dir = os.path.join(cwd, 'caches')
+    backend: CacheBackend | None = None
+    _backend_lock = threading.Lock()
+
+    @classmethod
+    def use_backend(cls, name: str) -> CacheBackend:
+        with cls._backend_lock:
+            cls.backend = cls.backends[name](cls.cache_dir)
+            return cls.backend
+
+    @classmethod
+    def get_backend(cls) -> CacheBackend:
+        if cls.backend is None:
+            with cls._backend_lock:
+                if cls.backend is None:
+                    cls.backend = SqliteCacheBackend(cls.cache_dir)
+        return cls.backend
+
+    @staticmethod
+    def get_key(params: dict[str, object]) -> str:
+        return "_".join(map(lambda x: str(x).lower(), params.values()))
+
+    @classmethod
+    def get_cache(cls, subdir: str, endpoint: str, params: dict[str, object]) -> dict[str, object] | None:
+        return cls.get_backend().get(subdir, endpoint, cls.get_key(params))
+
+    @classmethod
+    def store_cache(cls, subdir: str, endpoint: str, params: dict[str, object], data: dict[str, object], force: bool = False) -> None:
+        cls.get_backend().store(subdir, endpoint, cls.get_key(params), data, cls.cache_expirations_by_subdir[subdir], params=params, force=force)
+
+    @classmethod
+    def get_expires_at(cls, subdir: str, endpoint: str, params: dict[str, object]) -> datetime | None:
+        return cls.get_backend().get_expires_at(subdir, endpoint, cls.get_key(params))
+
+class LruCache:
+    def __init__(self, maxsize: int = 4096, ttl: timedelta = timedelta(hours=1)):
+        self.maxsize = maxsize
+        self.ttl = ttl.total_seconds()
+        self.entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> tuple[bool, object]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key: tuple, value: object) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class Unmemoized:
+    # Returned by a memoized function for a result it must not keep, such as a search that gave up polling.
+    def __init__(self, value: object):
+        self.value = value
+
+def memoize(maxsize: int = 4096, ttl: timedelta = timedelta(hours=1)) -> callable:
+    def decorator(func: callable) -> callable:
+        signature = inspect.signature(func)
+        cache = LruCache(maxsize, ttl)
+
+        def get_key(args: tuple, kwargs: dict[str, object]) -> tuple:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple(bound.arguments.items())[1:]
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = get_key(args, kwargs)
+                found, value = cache.get(key)
+                if not found:
+                    value = await func(*args, **kwargs)
+                    if isinstance(value, Unmemoized):
+                        return value.value
+                    cache.put(key, value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = get_key(args, kwargs)
+                found, value = cache.get(key)
+                if not found:
+                    value = func(*args, **kwargs)
+                    if isinstance(value, Unmemoized):
+                        return value.value
+                    cache.put(key, value)
+                return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+def migrate_json_cache(cache_dir: str, remove: bool = False) -> int:
+    source = JsonCacheBackend(cache_dir)
+    target = SqliteCacheBackend(cache_dir)
+    migrated = 0
+    for subdir, endpoint, key, path in source.iter_entries():
+        with open(path) as f:
+            data = json.load(f)
+        created_at = datetime.fromtimestamp(os.path.getmtime(path))
+        target.store(subdir, endpoint, key, data, CacheManager.cache_expirations_by_subdir[subdir], created_at=created_at)
+        if remove:
+            os.remove(path)
+        migrated += 1
+    return migrated
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Maintenance commands for the flights API cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='Copy the valid JSON cache files into the SQLite cache')
+    migrate.add_argument(
+        '--remove',
+        dest='remove',
+        action='store_true',
+        help="""
+        Delete each JSON cache file once it was copied
+        ex: --remove
+        """
+    )
+    vacuum = subparsers.add_parser('vacuum', help='Evict expired entries and compact the cache')
+    vacuum.add_argument(
+        '--backend',
+        dest='backend',
+        choices=list(CacheManager.backends),
+        default='sqlite',
+        help="""
+        Cache backend to clean up
+        ex: --backend json
+        """
+    )
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.command == 'migrate':
+        print_colored(GREEN, f'Migrated {migrate_json_cache(CacheManager.cache_dir, args.remove)} JSON cache files')
+    elif args.command == 'vacuum':
+        backend = CacheManager.use_backend(args.backend)
+        print_colored(GREEN, f'Evicted {backend.evict_expired()} expired cache entries')
+        if isinstance(backend, SqliteCacheBackend):
+            backend.vacuum()
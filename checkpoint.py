@@ -0,0 +1,87 @@
+import copy
+import json
+import os
+import threading
+from dataclasses import asdict
+from helper_functions import error
+from models import FlightOffer
+
+class Checkpoint:
+    def __init__(self, path: str, signature: dict[str, object], itinerary: list[dict[str, str | list[str] | int | bool | None]]):
+        self.path = path
+        self.signature = signature
+        self.itinerary = copy.deepcopy(itinerary)
+        self.lock = threading.Lock()
+        self.calendar_prices: dict[str, dict[str, float]] = {}
+        self.flights: dict[str, dict[str, str | float | int] | None] = {}
+        self.results: dict[str, list[dict[str, int | list[dict[str, str | float]]]]] = {}
+
+    @staticmethod
+    def get_key(values: tuple) -> str:
+        return '|'.join(map(str, values))
+
+    @classmethod
+    def create(cls, path: str, signature: dict[str, object], itinerary: list[dict[str, str | list[str] | int | bool | None]]) -> 'Checkpoint':
+        checkpoint = cls(path, signature, itinerary)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(json.dumps({'signature': signature, 'itinerary': checkpoint.itinerary}) + '\n')
+        return checkpoint
+
+    @classmethod
+    def resume(cls, path: str, signature: dict[str, object], itinerary: list[dict[str, str | list[str] | int | bool | None]] | None = None) -> 'Checkpoint':
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            error(f'No checkpoint found at {path}', 'Run without --resume to start a new plan')
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            error(f'The checkpoint at {path} has no valid header', 'Run without --resume to start a new plan')
+        if header['signature'] != signature or itinerary not in (None, header['itinerary']):
+            error(f'The checkpoint at {path} belongs to a different plan', 'Use the same --leave, --return and --itinerary or run without --resume')
+        checkpoint = cls(path, signature, header['itinerary'])
+        records_by_kind = {'calendar': checkpoint.calendar_prices, 'flight': checkpoint.flights, 'results': checkpoint.results}
+        for index, line in enumerate(lines[1:], 2):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be cut short by a crash while it was appended.
+                if index == len(lines):
+                    break
+                error(f'Line {index} of the checkpoint at {path} is not valid JSON', 'Run without --resume to start a new plan')
+            records_by_kind[record['kind']][record['key']] = record['value']
+        return checkpoint
+
+    def append(self, kind: str, key: str, value: object) -> None:
+        # One line per finished step, so nothing is rewritten and a crash keeps every step completed before it.
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'kind': kind, 'key': key, 'value': value}) + '\n')
+
+    def get_calendar_prices(self, query: tuple[str, str, str, str]) -> dict[int, float] | None:
+        calendar_prices = self.calendar_prices.get(self.get_key(query))
+        return None if calendar_prices is None else {int(date): price for date, price in calendar_prices.items()}
+
+    def store_calendar_prices(self, query: tuple[str, str, str, str], calendar_prices: dict[int, float]) -> None:
+        self.calendar_prices[self.get_key(query)] = calendar_prices
+        self.append('calendar', self.get_key(query), calendar_prices)
+
+    def has_flight(self, query: tuple[str, str, int, int, str, str, str]) -> bool:
+        return self.get_key(query) in self.flights
+
+    def get_flight(self, query: tuple[str, str, int, int, str, str, str]) -> FlightOffer | None:
+        flight = self.flights[self.get_key(query)]
+        return None if flight is None else FlightOffer(**flight)
+
+    def store_flight(self, query: tuple[str, str, int, int, str, str, str], flight: FlightOffer | None) -> None:
+        self.flights[self.get_key(query)] = None if flight is None else asdict(flight)
+        self.append('flight', self.get_key(query), self.flights[self.get_key(query)])
+
+    def get_results(self, variant: tuple) -> list[dict[str, int | list[dict[str, str | float]]]] | None:
+        return self.results.get(self.get_key(variant))
+
+    def store_results(self, variant: tuple, results: list[dict[str, int | list[dict[str, str | float]]]]) -> None:
+        self.results[self.get_key(variant)] = results
+        self.append('results', self.get_key(variant), results)
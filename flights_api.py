@@ -1,11 +1,18 @@
-import requests
+import asyncio
+import itertools
 import json
 import logging
 import os
 import sys
-from datetime import datetime, timedelta
-import re
-from helper_functions import logging, print_colored, get_int, error, check_time_in_interval, convert_string_to_time
+from datetime import date, datetime
+import threading
+from concurrent.futures import Future
+from typing import Generator
+from cache import CacheManager, Unmemoized, memoize
+from backends import ApiBackend, HttpBackend
+from instrumentation import instrumentation
+from models import FlightOffer
+from helper_functions import logging, print_colored, get_int, error, get_backoff_delay, hour_to_second, ordinal_to_date
 import time
 
 cwd = os.path.dirname(os.path.abspath(__file__))
@@ -15,145 +22,241 @@ RED = 31
 GREEN = 32
 YELLOW = 33
 
-class CacheManager:
-    cache_expirations_by_subdir = {
-        'calendar': timedelta(days=3),
-        'location_ids': timedelta(days=30),
-        'flights': timedelta(days=7),
-        'debug': timedelta(days=100)
-    }
-    
-    @classmethod
-    def check_cache_valid(cls, path: str) -> bool:
-        dir_name = os.path.basename(os.path.dirname(path))
-        return datetime.now() - datetime.fromtimestamp(os.path.getmtime(path)) < cls.cache_expirations_by_subdir[dir_name]
-    
-    @classmethod
-    def get_cache(cls, path: str) -> dict[str, object] | None:
-        if os.path.exists(path) and cls.check_cache_valid(path):
-            with open(path) as f:
-                return json.load(f)
-        return
+class FlightsApi:
+    _instances: dict[type, 'FlightsApi'] = {}
+    _instances_lock = threading.Lock()
     
+    def __init__(self, pool_size: int = 10, timeout: float = 30, requests_per_second: float = 5, monthly_quota: int | None = None, backend: ApiBackend | None = None):
+        self.backend = backend or HttpBackend(pool_size, timeout, requests_per_second, monthly_quota)
+        self._in_flight: dict[tuple[str, str], Future] = {}
+        self._in_flight_lock = threading.Lock()
+        
     @classmethod
-    def store_cache(cls, path: str, data: dict[str, object]) -> None:
-        if not os.path.exists(path) or not cls.check_cache_valid(path):
-            os.makedirs(os.path.dirname(path), mode=0o750, exist_ok=True)
-            with open(path, 'w') as f:
-                json.dump(data, f, indent=4)
-
-class FlightsApi:
-    def __init__(self):
-        try:
-            with open(f'{cwd}/credentials.json') as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            error(f'Please create credentials.json in this folder: {cwd}')
-            
-        try:
-            self.url: str = data['url']
-            self.credentials = {'x-rapidapi-key': data['x-rapidapi-key'], 'x-rapidapi-host': data['x-rapidapi-host']}
-        except KeyError:
-            error('One of the required fields is missing in credentials.json: url, x-rapidapi-key, x-rapidapi-host')
+    def get_instance(cls, **kwargs) -> 'FlightsApi':
+        with cls._instances_lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = cls(**kwargs)
+            return cls._instances[cls]
                 
     def _make_request(self, endpoint: str, params: dict[str, object]) -> dict[str, object]:
+        started_at = time.perf_counter()
+        try:
+            return self.backend.send(endpoint, params)
+        finally:
+            instrumentation.increment(endpoint, 'requests')
+            instrumentation.observe_latency(endpoint, time.perf_counter() - started_at)
+    
+    def send_api_request(self, endpoint: str, params: dict[str, object], cache_subdir: str, fallback_endpoint: str = None, refresh: bool = False) -> dict[str, object]:
+        key = (endpoint, CacheManager.get_key(params))
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[key] = Future()
+        if not is_leader:
+            return future.result()
+        
         try:
-            response = requests.get(self.url + endpoint, headers=self.credentials, params=params)
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            error(f'HTTP error occurred: {e}', f'Please make sure your credentials are correct and you have not exceeded the monthly requests quota')
-        except requests.exceptions.RequestException as e:
-            error(f'An error occurred: {e}')
-        return response.json()
-    
-    def send_api_request(self, endpoint: str, params: dict[str, object], cache_path: str, fallback_endpoint: str = None) -> dict[str, object]:
-        if cache := CacheManager.get_cache(cache_path):
+            data = self._send_api_request(endpoint, params, cache_subdir, fallback_endpoint, refresh)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+    
+    def count_uncached_requests(self, requests: list[dict[str, object]]) -> int:
+        now = datetime.now()
+        return sum(
+            (expires_at := CacheManager.get_expires_at(request['cache_subdir'], request['endpoint'], request['params'])) is None or expires_at <= now
+            for request in requests
+        )
+    
+    def _request_steps(self, endpoint: str, params: dict[str, object], cache_subdir: str, fallback_endpoint: str = None, refresh: bool = False) -> Generator[tuple[int | None, str, dict[str, object]], dict[str, object], dict[str, object]]:
+        # Caching and the soft/hard polling retries shared by both clients: yields (poll attempt or None, endpoint, params)
+        # for every request to send, receives its response and returns the final data.
+        if not refresh and (cache := CacheManager.get_cache(cache_subdir, endpoint, params)):
+            instrumentation.increment(endpoint, 'cache_hits')
             return cache
-        data = self._make_request(endpoint, params=params)
+        instrumentation.increment(endpoint, 'cache_misses')
+        data = yield None, endpoint, params
 
         if fallback_endpoint:
             soft_retry_count = 0
             hard_retry_count = 0
             sessionId = data['data']['context']['sessionId']
-            print(params, endpoint, cache_path, fallback_endpoint, '----', sessionId, data['data']['context']['status'])
+            logging.debug(f'{params} {endpoint} {sessionId} {data["data"]["context"]["status"]}')
             while data['data']['context']['status'] != 'complete':
-                time.sleep(2)
-                data = self._make_request(fallback_endpoint, params={'sessionId': sessionId, 'stops': params['stops']})
+                instrumentation.increment(endpoint, 'polls')
+                data = yield soft_retry_count, fallback_endpoint, {'sessionId': sessionId, 'stops': params['stops']}
                 soft_retry_count += 1
                 if hard_retry_count > 2:
                     return {}
                 if soft_retry_count > 5:
                     hard_retry_count += 1
                     soft_retry_count = 0
-                    data = self._make_request(endpoint, params=params)
+                    data = yield None, endpoint, params
                     sessionId = data['data']['context']['sessionId']
-                print(sessionId, data['data']['context']['status'], soft_retry_count, hard_retry_count)
+                logging.debug(f'{sessionId} {data["data"]["context"]["status"]} {soft_retry_count} {hard_retry_count}')
                     
             if data['data']['context']['status'] != 'complete':
-                CacheManager.store_cache(re.sub(r'flights', 'debug', cache_path), data)
+                CacheManager.store_cache('debug', endpoint, params, data)
                 return {}
-        CacheManager.store_cache(cache_path, data)
+        CacheManager.store_cache(cache_subdir, endpoint, params, data, force=refresh)
         return data
+
+    def _send_api_request(self, endpoint: str, params: dict[str, object], cache_subdir: str, fallback_endpoint: str = None, refresh: bool = False) -> dict[str, object]:
+        steps = self._request_steps(endpoint, params, cache_subdir, fallback_endpoint, refresh)
+        try:
+            poll_attempt, request_endpoint, request_params = next(steps)
+            while True:
+                if poll_attempt is not None:
+                    time.sleep(2)
+                poll_attempt, request_endpoint, request_params = steps.send(self._make_request(request_endpoint, params=request_params))
+        except StopIteration as stop:
+            return stop.value
     
     def search_airports_in_location(self, location: str) -> str | None:
-        return self.send_api_request(
-            endpoint='/flights/auto-complete',
-            params={'query': location.lower()},
-            cache_path=os.path.join(cwd, f'caches/location_ids/{location.lower()}.json')
-        )
+        return self.send_api_request(**self.location_request(location))
         
-    def get_flight_dates_by_route(self, from_entity: str, to_entity: str, month: int, year: int = datetime.now().year):
+    def get_flight_dates_by_route(self, from_entity: str, to_entity: str, month: int, year: int = datetime.now().year, stops: str = 'direct'):
+        return list(map(ordinal_to_date, self.get_flight_prices_by_route(from_entity, to_entity, month, year, stops)))
+    
+    @memoize()
+    def get_flight_prices_by_route(self, from_entity: str, to_entity: str, month: int, year: int = datetime.now().year, stops: str = 'direct') -> dict[int, float]:
+        return self._parse_flight_prices(self.send_api_request(**self.calendar_request(from_entity, to_entity, month, year)).get('data', []), stops)
+    
+    @memoize()
+    def get_flights_for_date(self, from_entity: str, to_entity: str, date: str, adults: int = 1, stops: str = 'direct', min_departure_hour: str = '00:00:00', max_departure_hour: str = '23:59:59') -> list[FlightOffer]:
+        data = self.send_api_request(**self.flights_request(from_entity, to_entity, date, adults, stops))
+        flights = self._parse_flights(data.get('data', {}).get('itineraries', []), from_entity, to_entity, min_departure_hour, max_departure_hour)
+        # An empty response is a search that stayed incomplete, it is retried by later plans like it is not cached on disk.
+        return flights if data else Unmemoized(flights)
+    
+    @staticmethod
+    def location_request(location: str) -> dict[str, object]:
+        return {
+            'endpoint': '/flights/auto-complete',
+            'params': {'query': location.lower()},
+            'cache_subdir': 'location_ids'
+        }
+    
+    @staticmethod
+    def calendar_request(from_entity: str, to_entity: str, month: int, year: int = datetime.now().year) -> dict[str, object]:
         params = {
             "fromEntityId":from_entity,
             "toEntityId":to_entity,
             "yearMonth":f"{year}-{month:02}"
         }
-        data = self.send_api_request(
-            endpoint='/flights/price-calendar-web',
-            params=params,
-            cache_path=os.path.join(cwd, f'caches/calendar/{"_".join(map(lambda x: str(x).lower(), params.values()))}.json')
-        ).get('data', [])
-        
-        tracerefs = set()
-        dates = set()
+        return {
+            'endpoint': '/flights/price-calendar-web',
+            'params': params,
+            'cache_subdir': 'calendar'
+        }
+    
+    @staticmethod
+    def flights_request(from_entity: str, to_entity: str, date: str, adults: int = 1, stops: str = 'direct') -> dict[str, object]:
+        params = {"fromEntityId":from_entity,"toEntityId":to_entity,"departDate":date,"adults":adults,"stops":stops}
+        return {
+            'endpoint': '/flights/search-one-way',
+            'params': params,
+            'cache_subdir': 'flights',
+            'fallback_endpoint': '/flights/search-incomplete'
+        }
+    
+    @staticmethod
+    def _parse_flight_prices(data: dict[str, object], stops: str = 'direct') -> dict[int, float]:
+        grid_keys = ['Direct'] if stops == 'direct' else ['Direct', 'Indirect']
+        prices = {}
         for grids in data['PriceGrids']['Grid']:
             for grid in grids:
-                if 'Direct' in grid:
-                    tracerefs.add(*grid['Direct']['TraceRefs'])
-                
-        for traceref in tracerefs:
-            
-            date = data['Traces'][traceref].split('*')[4]
-            dates.add(datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d"))
+                for grid_key in grid_keys:
+                    if grid_key not in grid:
+                        continue
+                    for traceref in grid[grid_key]['TraceRefs']:
+                        day = data['Traces'][traceref].split('*')[4]
+                        ordinal = date(int(day[:4]), int(day[4:6]), int(day[6:8])).toordinal()
+                        prices[ordinal] = min(prices.get(ordinal, grid[grid_key]['Price']), grid[grid_key]['Price'])
             
-        return sorted(list(dates))
+        return dict(sorted(prices.items()))
     
-    def get_flights_for_date(self, from_entity: str, to_entity: str, date: str, adults: int = 1, stops: str = 'direct', min_departure_hour: str = '00:00:00', max_departure_hour: str = '23:59:59') -> list[dict[str, int | str]]:
-        params = {"fromEntityId":from_entity,"toEntityId":to_entity,"departDate":date,"adults":adults,"stops":stops}
-        flights = self.send_api_request(
-            endpoint='/flights/search-one-way',
-            params=params,
-            cache_path=os.path.join(cwd, f'caches/flights/{"_".join(map(lambda x: str(x).lower(), params.values()))}.json'),
-            fallback_endpoint='/flights/search-incomplete'
-        ).get('data', {}).get('itineraries', [])
-        
-        dates = []
+    @staticmethod
+    def _parse_flights(flights: list[dict[str, object]], from_entity: str, to_entity: str, min_departure_hour: str, max_departure_hour: str) -> list[FlightOffer]:
+        min_departure_second = hour_to_second(min_departure_hour)
+        max_departure_second = hour_to_second(max_departure_hour)
+        offers = []
         for flight in flights:
-            flight_departure = convert_string_to_time(flight["legs"][0]["departure"])
-            condition = check_time_in_interval(
-                check_time=flight_departure,
-                start_time=convert_string_to_time(min_departure_hour, format='%H:%M:%S'),
-                end_time=convert_string_to_time(max_departure_hour, format='%H:%M:%S')
-            )
-            if condition:
-                dates.append(
-                    {
-                        "price": flight["price"]["raw"],
-                        "departure": flight["legs"][0]["departure"],
-                        "arrival": flight["legs"][-1]["arrival"],
-                    }
-                )
-        return dates
+            departure = flight["legs"][0]["departure"]
+            departure_second = hour_to_second(departure[11:])
+            if min_departure_second <= departure_second <= max_departure_second:
+                offers.append(FlightOffer(
+                    from_entity=from_entity,
+                    to_entity=to_entity,
+                    price=flight["price"]["raw"],
+                    departure=departure,
+                    arrival=flight["legs"][-1]["arrival"],
+                    departure_second=departure_second
+                ))
+        return offers
+
+class AsyncFlightsApi(FlightsApi):
+    def __init__(self, pool_size: int = 10, timeout: float = 30, requests_per_second: float = 5, monthly_quota: int | None = None, backend: ApiBackend | None = None):
+        super().__init__(pool_size, timeout, requests_per_second, monthly_quota, backend)
+        # Tasks belong to the event loop that created them, so concurrent plans each running their own loop are keyed apart.
+        self._in_flight_tasks: dict[tuple[asyncio.AbstractEventLoop, str, str], asyncio.Task] = {}
+    
+    async def _make_request_async(self, endpoint: str, params: dict[str, object]) -> dict[str, object]:
+        return await asyncio.to_thread(self._make_request, endpoint, params)
+    
+    async def send_api_request(self, endpoint: str, params: dict[str, object], cache_subdir: str, fallback_endpoint: str = None, refresh: bool = False) -> dict[str, object]:
+        key = (asyncio.get_running_loop(), endpoint, CacheManager.get_key(params))
+        if key not in self._in_flight_tasks:
+            task = asyncio.ensure_future(self._send_api_request(endpoint, params, cache_subdir, fallback_endpoint, refresh))
+            task.add_done_callback(lambda _: self._in_flight_tasks.pop(key, None))
+            self._in_flight_tasks[key] = task
+        return await asyncio.shield(self._in_flight_tasks[key])
+    
+    async def _send_api_request(self, endpoint: str, params: dict[str, object], cache_subdir: str, fallback_endpoint: str = None, refresh: bool = False) -> dict[str, object]:
+        steps = self._request_steps(endpoint, params, cache_subdir, fallback_endpoint, refresh)
+        try:
+            poll_attempt, request_endpoint, request_params = next(steps)
+            while True:
+                if poll_attempt is not None:
+                    await asyncio.sleep(get_backoff_delay(poll_attempt))
+                poll_attempt, request_endpoint, request_params = steps.send(await self._make_request_async(request_endpoint, params=request_params))
+        except StopIteration as stop:
+            return stop.value
+    
+    async def search_airports_in_location(self, location: str) -> str | None:
+        return await self.send_api_request(**self.location_request(location))
+    
+    async def get_flight_dates_by_route(self, from_entity: str, to_entity: str, month: int, year: int = datetime.now().year, stops: str = 'direct'):
+        return list(map(ordinal_to_date, await self.get_flight_prices_by_route(from_entity, to_entity, month, year, stops)))
+    
+    @memoize()
+    async def get_flight_prices_by_route(self, from_entity: str, to_entity: str, month: int, year: int = datetime.now().year, stops: str = 'direct') -> dict[int, float]:
+        return self._parse_flight_prices((await self.send_api_request(**self.calendar_request(from_entity, to_entity, month, year))).get('data', []), stops)
+    
+    @memoize()
+    async def get_flights_for_date(self, from_entity: str, to_entity: str, date: str, adults: int = 1, stops: str = 'direct', min_departure_hour: str = '00:00:00', max_departure_hour: str = '23:59:59') -> list[FlightOffer]:
+        data = await self.send_api_request(**self.flights_request(from_entity, to_entity, date, adults, stops))
+        flights = self._parse_flights(data.get('data', {}).get('itineraries', []), from_entity, to_entity, min_departure_hour, max_departure_hour)
+        return flights if data else Unmemoized(flights)
+    
+    async def get_flights_for_dates(self, searches: list[dict[str, str | int]], concurrency: int, on_result: callable = None) -> list[list[FlightOffer]]:
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def search(index: int, kwargs: dict[str, str | int]) -> list[FlightOffer]:
+            async with semaphore:
+                flights = await self.get_flights_for_date(**kwargs)
+            if on_result:
+                on_result(index, flights)
+            return flights
+            
+        return await asyncio.gather(*itertools.starmap(search, enumerate(searches)))
 
 
 
@@ -1,6 +1,11 @@
+import json
 import logging
+import os
+import random
 import sys
-from datetime import datetime, timedelta, time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, time
 
 RED = 31
 GREEN = 32
@@ -24,6 +29,15 @@ def get_int(message: str) -> int:
     else:
         error('Failed to get int')
         
+def get_ints(message: str, sep: str = ',') -> list[int]:
+    for _ in range(3):
+        try:
+            return [int(value) for value in input(message).split(sep)]
+        except ValueError:
+            print_colored(YELLOW, f'Write only numbers separated by "{sep}" and press ENTER')
+    else:
+        error('Failed to get ints')
+        
 def get_hour(message: str) -> str:
     for _ in range(3):
         try:
@@ -85,4 +99,65 @@ def check_time_in_interval(check_time: time, start_time: time = time(0, 0), end_
     return start_time <= check_time <= end_time
 
 def increase_date_by_days(date: str, days: int, format: str = '%Y-%m-%d') -> str:
-    return (datetime.strptime(date, format) + timedelta(days=days)).strftime(format)
\ No newline at end of file
+    return (datetime.strptime(date, format) + timedelta(days=days)).strftime(format)
+
+def to_list(value: str | list[str]) -> list[str]:
+    return value if isinstance(value, list) else [value]
+
+def is_whole_number(value: object) -> bool:
+    # JSON true and false are ints to Python.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def get_variant_options_error(adults_options: list, stops_options: list) -> str | None:
+    if not adults_options or not stops_options:
+        return 'adults and stops need at least one value each'
+    for adults in adults_options:
+        if not is_whole_number(adults) or adults < 1:
+            return f'adults({adults}) must be a whole number of at least 1'
+    for stops in stops_options:
+        if not isinstance(stops, str) or not set(stops.split(',')) <= {'direct', '1stop', '2stops'}:
+            return f'stops({stops}) must be direct, 1stop, 2stops or a comma separated combination of them'
+    return None
+
+def date_to_ordinal(value: str) -> int:
+    return date.fromisoformat(value).toordinal()
+
+def ordinal_to_date(ordinal: int) -> str:
+    return date.fromordinal(ordinal).isoformat()
+
+def hour_to_second(hour: str) -> int:
+    return int(hour[:2]) * 3600 + int(hour[3:5]) * 60 + int(hour[6:8] or 0)
+
+def get_backoff_delay(attempt: int, base_delay: float = 1, max_delay: float = 16) -> float:
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+# Read once at import, os.umask cannot be read without setting it, which is not thread safe.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def write_json_atomically(path: str, data: object, **kwargs) -> None:
+    # A unique temporary file, so concurrent writers never replace with each other's half written file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, **kwargs)
+        # mkstemp creates the file with mode 0600, give it the mode open() would.
+        os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def map_concurrently(function: callable, items: list, workers: int) -> list:
+    # Unlike executor.map in a with block, the first failure (error() included) cancels the calls still queued instead of running them all.
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(items))))
+    try:
+        futures = [executor.submit(function, item) for item in items]
+        for future in as_completed(futures):
+            future.result()
+    except BaseException:
+        executor.shutdown(cancel_futures=True)
+        raise
+    executor.shutdown()
+    return [future.result() for future in futures]
@@ -0,0 +1,108 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Iterator
+from helper_functions import GREEN, print_colored
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+COUNTERS = ['requests', 'cache_hits', 'cache_misses', 'polls', 'retries', 'bytes', 'missing']
+
+class Instrumentation:
+    def __init__(self, max_spans: int = 10000):
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started_at = time.perf_counter()
+            # Only the latest spans are kept for the trace, the phase totals cover every span of a long running server.
+            self.spans: deque[tuple[str, int, float, float]] = deque(maxlen=self.max_spans)
+            self.phases: dict[str, dict[str, int | float]] = {}
+            self.counters: dict[str, dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+            self.latencies: dict[str, list[int]] = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+            self.latency_sums: dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+            with self.lock:
+                self.spans.append((name, threading.get_ident(), started_at - self.started_at, duration))
+                phase = self.phases.setdefault(name, {'count': 0, 'seconds': 0.0})
+                phase['count'] += 1
+                phase['seconds'] += duration
+
+    def increment(self, endpoint: str, counter: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[endpoint][counter] += amount
+
+    def observe_latency(self, endpoint: str, seconds: float) -> None:
+        with self.lock:
+            self.latencies[endpoint][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.latency_sums[endpoint] += seconds
+
+    @staticmethod
+    def get_percentile(buckets: list[int], percentile: float) -> float | None:
+        # Upper bound of the histogram bucket holding the percentile, None past the last bucket.
+        rank = percentile * sum(buckets)
+        seen = 0
+        for index, count in enumerate(buckets):
+            seen += count
+            if count and seen >= rank:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+        return None
+
+    def summary(self) -> dict[str, object]:
+        with self.lock:
+            phases = {name: dict(phase) for name, phase in self.phases.items()}
+            endpoints = {}
+            for endpoint, counters in self.counters.items():
+                buckets = self.latencies.get(endpoint, [0] * (len(LATENCY_BUCKETS) + 1))
+                observed = sum(buckets)
+                endpoints[endpoint] = {
+                    **counters,
+                    'latency': {
+                        'buckets': dict(zip([*map(str, LATENCY_BUCKETS), 'inf'], buckets)),
+                        'mean': self.latency_sums[endpoint] / observed if observed else None,
+                        'p50': self.get_percentile(buckets, 0.5),
+                        'p95': self.get_percentile(buckets, 0.95)
+                    }
+                }
+            return {'wall_seconds': time.perf_counter() - self.started_at, 'phases': phases, 'endpoints': endpoints}
+
+    def get_trace_events(self) -> list[dict[str, object]]:
+        with self.lock:
+            return [
+                {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread, 'ts': start * 1e6, 'dur': duration * 1e6}
+                for name, thread, start, duration in self.spans
+            ]
+
+    def write(self, path: str) -> None:
+        # traceEvents makes the same file loadable in chrome://tracing or Perfetto.
+        with open(path, 'w') as f:
+            json.dump({**self.summary(), 'traceEvents': self.get_trace_events()}, f, indent=4)
+
+    def print_summary(self) -> None:
+        summary = self.summary()
+        print_colored(GREEN, f'Profile: {summary["wall_seconds"]:.2f}s wall time')
+        for name, phase in summary['phases'].items():
+            print(f'  {name:<24} {phase["count"]:>6}x {phase["seconds"]:>9.3f}s')
+        for endpoint, counters in summary['endpoints'].items():
+            latency = counters['latency']
+            mean = f'{latency["mean"] * 1000:.0f}ms' if latency['mean'] is not None else '-'
+            p95 = f'{latency["p95"]}s' if latency['p95'] is not None else '-'
+            missing = f', {counters["missing"]} not recorded' if counters['missing'] else ''
+            print(
+                f'  {endpoint:<28} requests {counters["requests"]}, cache {counters["cache_hits"]} hits / {counters["cache_misses"]} misses, '
+                f'polls {counters["polls"]}, retries {counters["retries"]}, {counters["bytes"] / 1024:.1f} KiB, mean latency {mean}, p95 <= {p95}{missing}'
+            )
+
+instrumentation = Instrumentation()
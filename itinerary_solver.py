@@ -0,0 +1,39 @@
+import heapq
+from typing import Iterator
+
+def get_next_dates(date: int, next_dates: set[int] | dict[int, object], stay: tuple[int, int]) -> list[int]:
+    min_stay_duration, max_stay_duration = stay
+    return [next_date for next_date in range(date + min_stay_duration, date + max_stay_duration + 1) if next_date in next_dates]
+
+def prune_leg_dates(leg_dates: list[list[int]], stays: list[tuple[int, int]]) -> list[list[int]]:
+    pruned = [set(dates) for dates in leg_dates]
+    for index, stay in enumerate(stays):
+        pruned[index + 1] = {
+            next_date for date in pruned[index]
+            for next_date in get_next_dates(date, pruned[index + 1], stay)
+        }
+    for index in reversed(range(len(stays))):
+        pruned[index] = {date for date in pruned[index] if get_next_dates(date, pruned[index + 1], stays[index])}
+    return [sorted(dates) for dates in pruned]
+
+def iter_cheapest_itineraries(leg_prices: list[dict[int, float]], stays: list[tuple[int, int]]) -> Iterator[tuple[float, list[int]]]:
+    # Cheapest price from each (leg, date) node to the end of the trip. With it as an exact
+    # heuristic the best-first search below pops complete itineraries in order of total price.
+    cheapest_completion = [{} for _ in leg_prices]
+    cheapest_completion[-1] = dict(leg_prices[-1])
+    for index in reversed(range(len(stays))):
+        for date, price in leg_prices[index].items():
+            next_dates = get_next_dates(date, cheapest_completion[index + 1], stays[index])
+            if next_dates:
+                cheapest_completion[index][date] = price + min(cheapest_completion[index + 1][next_date] for next_date in next_dates)
+
+    heap = [(completion, leg_prices[0][date], [date]) for date, completion in cheapest_completion[0].items()]
+    heapq.heapify(heap)
+    while heap:
+        _, total, path = heapq.heappop(heap)
+        index = len(path) - 1
+        if index == len(stays):
+            yield total, path
+            continue
+        for next_date in get_next_dates(path[-1], cheapest_completion[index + 1], stays[index]):
+            heapq.heappush(heap, (total + cheapest_completion[index + 1][next_date], total + leg_prices[index + 1][next_date], path + [next_date]))
@@ -1,93 +1,124 @@
-from flights_api import FlightsApi
+from flights_api import FlightsApi, AsyncFlightsApi
+from backends import HttpBackend, ReplayBackend, SyntheticBackend
+from cache import CacheManager
 from arguments import parse_arguments
-from helper_functions import print_colored, get_int, error, yes_no_question, get_hour, generate_date_range, validate_itinerary_stay_limits, calculate_total_duration, get_months_from_dates, convert_string_to_time, increase_date_by_days
+from helper_functions import GREEN, YELLOW, print_colored, get_int, get_ints, error, yes_no_question, get_hour, validate_itinerary_stay_limits, convert_string_to_time
+from models import PlanOptions
+from checkpoint import Checkpoint
+from instrumentation import instrumentation
+from batch import run_batch
+from planner import mutate_itinerary_with_possible_flight_dates, report_planned_requests, get_calendar_queries, fetch_calendar_prices, build_legs, filter_itinerary_by_calendar, get_flight_requests, get_variants, get_variant_path, get_variant_suffix, rank_variants
+import atexit
 import os
+import copy
+import shutil
+import tempfile
 import json
 from datetime import datetime, timedelta, time
 import sys
-import copy
 
 def main():
     args = parse_arguments()
-    if not args.itinerary:
-        itinerary = create_itinerary()
-        with open('itinerary.json', 'w') as f:
-            json.dump(itinerary, f, indent=4)
+    instrumentation.reset()
+    use_cache(args)
+    client_options = get_client_options(args)
+    FlightsApi.get_instance(**client_options)
+    if args.use_async:
+        AsyncFlightsApi.get_instance(**client_options)
+    try:
+        if args.batch:
+            run_batch(args)
+        else:
+            plan(args)
+    finally:
+        if isinstance(FlightsApi.get_instance().backend, ReplayBackend):
+            FlightsApi.get_instance().backend.warn_missing()
+        if args.profile:
+            instrumentation.print_summary()
+            instrumentation.write(args.profile)
+
+def use_cache(args: object) -> None:
+    if args.backend != 'http':
+        # Replayed and generated responses must neither come from nor end up in the real cache.
+        CacheManager.cache_dir = tempfile.mkdtemp(prefix='holiday_planner_')
+        atexit.register(shutil.rmtree, CacheManager.cache_dir, ignore_errors=True)
+    CacheManager.use_backend(args.cache_backend)
+
+def get_client_options(args: object) -> dict[str, object]:
+    client_options = {
+        'pool_size': args.pool_size,
+        'timeout': args.timeout,
+        'requests_per_second': args.requests_per_second,
+        'monthly_quota': args.monthly_quota
+    }
+    if args.backend == 'replay':
+        client_options['backend'] = ReplayBackend(args.fixtures)
+    elif args.backend == 'synthetic':
+        client_options['backend'] = SyntheticBackend()
     else:
-        with open(args.itinerary) as f:
-            itinerary = json.load(f)
-    validate_itinerary_stay_limits(
-        start_date=args.start_date,
-        end_date=args.end_date,
-        max_duration=sum([leg['max_stay_duration'] or 0 for leg in itinerary])
-    )
-    mutate_itinerary_with_possible_flight_dates(itinerary, args.start_date, args.end_date)
-    with open('itinerary_semi.json', 'w') as f:
-        pass
-    for leg in itinerary:
-        available_flight_dates = []
-        for month in leg['months']:
-            available_flight_dates.extend(
-                FlightsApi().get_flight_dates_by_route(
-                    from_entity=leg['fromEntityId'],
-                    to_entity=leg['toEntityId'],
-                    month=month
-                )
-            )
-        leg['flights'] = {flight: [] for flight in leg['flights'] if flight in available_flight_dates}
-        
-    with open('itinerary_semi.json', 'w') as f:
-        json.dump(itinerary, f, indent=4)
+        # One backend for the sync and async clients, so they share the --rps bucket and the quota count.
+        client_options['backend'] = HttpBackend(**client_options)
+    return client_options
 
-    for index in range(len(itinerary) - 1):
-        if index == 0:
-            legs = list(map(lambda x: [x], itinerary[index]['flights']))
+def plan(args: object) -> None:
+    with instrumentation.span('itinerary'):
+        if args.itinerary:
+            with open(args.itinerary) as f:
+                itinerary = json.load(f)
+        elif not args.resume:
+            itinerary = create_itinerary()
+            with open('itinerary.json', 'w') as f:
+                json.dump(itinerary, f, indent=4)
         else:
-            legs = possible_itineraries
-        possible_itineraries = extend_itinerary_with_leg(legs, itinerary[index + 1]['flights'], itinerary[index]['min_stay_duration'], itinerary[index]['max_stay_duration'])
-        
-    complete_itineraries = []
-    filtered_possible_itineraries = copy.deepcopy(possible_itineraries)
-    for possible_itinerary in possible_itineraries:
-        if possible_itinerary not in filtered_possible_itineraries: continue
-        complete_itinerary = {'total': None, 'legs': []}
-        for index, date in enumerate(possible_itinerary):
-            flights = FlightsApi().get_flights_for_date(
-                from_entity=itinerary[index]['fromEntityId'],
-                to_entity=itinerary[index]['toEntityId'],
-                date=date,
-                min_departure_hour=itinerary[index]['min_departure_hour'],
-                max_departure_hour=itinerary[index]['max_departure_hour']
-            )
-            try: 
-                flight = get_cheapest_flight(flights)
-            except IndexError:
-                filtered_possible_itineraries = [filtered_possible_itinerary for filtered_possible_itinerary in filtered_possible_itineraries if filtered_possible_itinerary[index] != date]
-                break
-            complete_itinerary['legs'].append({
-                'fromEntityId': itinerary[index]['fromEntityId'],
-                'toEntityId': itinerary[index]['toEntityId'],
-                'date': date,
-                'price': flight['price'],
-                'departure': flight['departure'],
-                'arrival': flight['arrival']
-            })
+            itinerary = None
+        checkpoint_signature = {'start_date': args.start_date, 'end_date': args.end_date}
+        if args.resume:
+            checkpoint = Checkpoint.resume('checkpoint.jsonl', checkpoint_signature, itinerary)
+            itinerary = copy.deepcopy(checkpoint.itinerary)
         else:
-            complete_itinerary['total'] = int(sum(map(lambda leg: leg['price'], complete_itinerary['legs'])))
-            complete_itineraries.append(complete_itinerary)
-    
-    complete_itineraries.sort(key=lambda itinerary: itinerary['total'])
-    with open('final_result.json', 'w') as w:
-        json.dump(complete_itineraries, w, indent=4)
+            checkpoint = Checkpoint.create('checkpoint.jsonl', checkpoint_signature, itinerary)
+        validate_itinerary_stay_limits(
+            start_date=args.start_date,
+            end_date=args.end_date,
+            max_duration=sum([leg['max_stay_duration'] or 0 for leg in itinerary])
+        )
+        mutate_itinerary_with_possible_flight_dates(itinerary, args.start_date, args.end_date)
+        with open('itinerary_semi.json', 'w') as f:
+            pass
+    with instrumentation.span('calendar'):
+        calendar_queries = get_calendar_queries(itinerary, args.stops)
+        report_planned_requests('Price calendars', [FlightsApi.calendar_request(*route) for route in dict.fromkeys(query[:3] for query in calendar_queries)])
+        calendar_prices_by_query = fetch_calendar_prices(calendar_queries, args.workers, checkpoint)
+    with instrumentation.span('legs'):
+        legs_by_stops = {}
+        for stops in args.stops:
+            legs_by_stops[stops] = build_legs(itinerary, calendar_prices_by_query, stops)
+            with open(get_variant_path('itinerary_semi.json', stops.replace(',', '+') if len(args.stops) > 1 else None), 'w') as f:
+                json.dump(filter_itinerary_by_calendar(itinerary, legs_by_stops[stops]), f, indent=4)
+
+    variants = get_variants(args.adults, args.stops)
+    with instrumentation.span('estimate'):
+        report_planned_requests('Flight searches', [request for adults, stops in variants for request in get_flight_requests(legs_by_stops[stops], adults, stops)])
+    if args.estimate:
+        return
+    with instrumentation.span('ranking'):
+        results = rank_variants(legs_by_stops, variants, PlanOptions.from_args(args, checkpoint))
+    with instrumentation.span('output'):
+        for (adults, stops), complete_itineraries in results.items():
+            with open(get_variant_path('final_result.json', get_variant_suffix(adults, stops, variants)), 'w') as w:
+                json.dump(complete_itineraries, w, indent=4)
+            if len(variants) > 1:
+                best = f'cheapest total {complete_itineraries[0]["total"]}' if complete_itineraries else 'no itineraries found'
+                print_colored(GREEN, f'{adults} adults, {stops}: {best}')
             
             
 
             
-def get_airport(location: str) -> str:
+def get_airport(location: str) -> str | list[str]:
     location = location.strip()
     if not location:
         return
-    airports = FlightsApi().search_airports_in_location(location)
+    airports = FlightsApi.get_instance().search_airports_in_location(location)
     if not airports.get('data', []):
             print_colored(YELLOW, f'Did not find any available Airports for your desired location: {location}',
             'Please make sure to input only valid ones!',
@@ -98,9 +129,10 @@ def get_airport(location: str) -> str:
         print(f'{index:<2}: {entity["presentation"]["suggestionTitle"]}')
         
     for _ in range(3):
-        choice = get_int('Please enter the number for the desired location: ')
+        choices = get_ints('Please enter the number for the desired location (or several numbers separated by "," to compare airports): ')
         try:
-            return airports['data'][choice]['navigation']['relevantFlightParams']['skyId']
+            sky_ids = list(dict.fromkeys(airports['data'][choice]['navigation']['relevantFlightParams']['skyId'] for choice in choices))
+            return sky_ids[0] if len(sky_ids) == 1 else sky_ids
         except IndexError:
             print_colored(YELLOW, 'Invalid number, please enter a valid number from the choices list')
     else:
@@ -157,38 +189,6 @@ def create_itinerary() -> list[dict[str, str | int | bool | None]]:
     return itinerary
     
     
-def mutate_itinerary_with_possible_flight_dates(itinerary: list[dict[str, str | int | bool | None]], start_date: str, end_date: str, format: str = '%Y-%m-%d')-> None:
-    min_date = datetime.strptime(start_date, format)
-    max_date = datetime.strptime(end_date, format)
-
-    min_duration = calculate_total_duration(itinerary, 'min_stay_duration')
-
-    for index, leg in enumerate(itinerary):
-        if index == 0:
-            dates = generate_date_range(start_date, (max_date - min_duration).strftime('%Y-%m-%d'))
-        elif not leg['min_stay_duration']:
-            dates = generate_date_range((min_date + min_duration).strftime('%Y-%m-%d'), end_date)
-        else:
-            previous_legs_min_duration = calculate_total_duration(itinerary[:index], 'min_stay_duration')
-            future_legs_max_duration = calculate_total_duration(itinerary[index + 1:], 'max_stay_duration')
-            dates = generate_date_range((min_date + previous_legs_min_duration).strftime('%Y-%m-%d'), (max_date - future_legs_max_duration).strftime('%Y-%m-%d'))
-        dates = list(dates)
-        leg.update({'months': get_months_from_dates(dates)})
-        leg.update({'flights': {date: [] for date in dates} })
-        
-def extend_itinerary_with_leg(legs: list[list[str]], availabe_return_dates: list[str], min_stay_duration: int, max_stay_duration: int) -> list[list[str]]:
-    extended_legs = []
-    for leg in legs:
-        start_date = leg[-1]
-        for duration in range(min_stay_duration, max_stay_duration + 1):
-            if (return_date := increase_date_by_days(start_date, duration)) in availabe_return_dates:
-                extended_legs.append(leg + [return_date])
-    return extended_legs
-
-def get_cheapest_flight(flights: list[dict]) -> dict[str, str | float]:
-    return sorted(flights, key=lambda flight: flight['price'])[0]
-    
-    
 if __name__ == '__main__':
     cwd = os.path.dirname(os.path.abspath(__file__))
     RED = 31
@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from checkpoint import Checkpoint
+
+@dataclass(slots=True)
+class FlightOffer:
+    from_entity: str
+    to_entity: str
+    price: float
+    departure: str
+    arrival: str
+    departure_second: int
+
+@dataclass(slots=True)
+class Leg:
+    min_stay_duration: int | None
+    max_stay_duration: int | None
+    min_departure_hour: str
+    max_departure_hour: str
+    route_calendar_prices: dict[tuple[str, str], dict[int, float]]
+    calendar_prices: dict[int, float]
+
+    @classmethod
+    def from_dict(cls, leg: dict[str, str | list[str] | int | bool | None], route_calendar_prices: dict[tuple[str, str], dict[int, float]]) -> 'Leg':
+        calendar_prices = {}
+        for prices in route_calendar_prices.values():
+            for date, price in prices.items():
+                calendar_prices[date] = min(calendar_prices.get(date, price), price)
+        return cls(
+            min_stay_duration=leg['min_stay_duration'],
+            max_stay_duration=leg['max_stay_duration'],
+            min_departure_hour=leg['min_departure_hour'],
+            max_departure_hour=leg['max_departure_hour'],
+            route_calendar_prices=route_calendar_prices,
+            calendar_prices=dict(sorted(calendar_prices.items()))
+        )
+
+    @property
+    def stay(self) -> tuple[int, int]:
+        return (self.min_stay_duration, self.max_stay_duration)
+
+    def get_routes_for_date(self, date: int) -> list[tuple[str, str]]:
+        routes = [route for route, prices in self.route_calendar_prices.items() if date in prices]
+        return sorted(routes, key=lambda route: self.route_calendar_prices[route][date])
+
+@dataclass(slots=True)
+class PlanOptions:
+    top: int = 10
+    workers: int = 8
+    use_async: bool = False
+    lazy: bool = False
+    engine: str = 'search'
+    stream: bool = False
+    checkpoint: 'Checkpoint | None' = None
+
+    @classmethod
+    def from_args(cls, args: object, checkpoint: 'Checkpoint | None' = None) -> 'PlanOptions':
+        return cls(top=args.top, workers=args.workers, use_async=args.use_async, lazy=args.lazy, engine=args.engine, stream=args.stream, checkpoint=checkpoint)
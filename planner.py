@@ -0,0 +1,283 @@
+import asyncio
+import heapq
+import itertools
+from flights_api import FlightsApi, AsyncFlightsApi
+from datetime import datetime
+from helper_functions import GREEN, YELLOW, print_colored, map_concurrently, to_list, date_to_ordinal, ordinal_to_date, generate_date_range, calculate_total_duration, get_months_from_dates
+from models import Leg, FlightOffer, PlanOptions
+from itinerary_solver import prune_leg_dates, iter_cheapest_itineraries
+from price_matrix import find_cheapest_itineraries
+from result_stream import ResultStream
+from checkpoint import Checkpoint
+from instrumentation import instrumentation
+
+def mutate_itinerary_with_possible_flight_dates(itinerary: list[dict[str, str | int | bool | None]], start_date: str, end_date: str, format: str = '%Y-%m-%d')-> None:
+    min_date = datetime.strptime(start_date, format)
+    max_date = datetime.strptime(end_date, format)
+
+    min_duration = calculate_total_duration(itinerary, 'min_stay_duration')
+
+    for index, leg in enumerate(itinerary):
+        if index == 0:
+            dates = generate_date_range(start_date, (max_date - min_duration).strftime('%Y-%m-%d'))
+        elif not leg['min_stay_duration']:
+            dates = generate_date_range((min_date + min_duration).strftime('%Y-%m-%d'), end_date)
+        else:
+            previous_legs_min_duration = calculate_total_duration(itinerary[:index], 'min_stay_duration')
+            future_legs_max_duration = calculate_total_duration(itinerary[index + 1:], 'max_stay_duration')
+            dates = generate_date_range((min_date + previous_legs_min_duration).strftime('%Y-%m-%d'), (max_date - future_legs_max_duration).strftime('%Y-%m-%d'))
+        dates = list(dates)
+        leg.update({'months': get_months_from_dates(dates)})
+        leg.update({'flights': {date: [] for date in dates} })
+
+def report_planned_requests(description: str, requests: list[dict[str, object]]) -> None:
+    flights_api = FlightsApi.get_instance()
+    uncached = flights_api.count_uncached_requests(requests)
+    quota = flights_api.backend.quota
+    if quota is None:
+        print_colored(GREEN, f'{description}: {uncached} of {len(requests)} not cached')
+        return
+    usage = f'{quota.used()} requests used this month'
+    if quota.monthly_quota is not None:
+        usage += f', {quota.remaining()} of {quota.monthly_quota} remaining'
+    # Searches are pruned by calendar price while running, and unfinished ones are polled, so their count is only a bound.
+    if any(request.get('fallback_endpoint') for request in requests):
+        cost = f'at most {uncached} searches plus polling of unfinished ones'
+    else:
+        cost = f'{uncached} API requests'
+    color = YELLOW if quota.remaining() is not None and uncached > quota.remaining() else GREEN
+    print_colored(color, f'{description}: {uncached} of {len(requests)} not cached, costing {cost} ({usage})')
+
+def get_leg_routes(leg: dict[str, str | list[str] | int | bool | None]) -> list[tuple[str, str]]:
+    return [route for route in itertools.product(to_list(leg['fromEntityId']), to_list(leg['toEntityId'])) if route[0] != route[1]]
+
+def get_calendar_query(route: tuple[str, str], month: str, stops: str) -> tuple[str, str, str, str]:
+    return (*route, month, stops)
+
+def fetch_calendar_prices_for_query(query: tuple[str, str, str, str]) -> dict[int, float]:
+    from_entity, to_entity, month, stops = query
+    return FlightsApi.get_instance().get_flight_prices_by_route(from_entity=from_entity, to_entity=to_entity, month=month, stops=stops)
+
+def get_calendar_queries(itinerary: list[dict[str, str | int | bool | None]], stops_options: list[str]) -> list[tuple[str, str, str, str]]:
+    return list(dict.fromkeys(
+        get_calendar_query(route, month, stops)
+        for stops in stops_options for leg in itinerary for route in get_leg_routes(leg) for month in leg['months']
+    ))
+
+def fetch_calendar_prices(queries: list[tuple[str, str, str, str]], workers: int, checkpoint: Checkpoint | None = None) -> dict[tuple[str, str, str, str], dict[int, float]]:
+    calendar_prices_by_query = {query: checkpoint.get_calendar_prices(query) for query in queries} if checkpoint else {}
+    missing = [query for query in queries if calendar_prices_by_query.get(query) is None]
+
+    def fetch(query: tuple[str, str, str, str]) -> dict[int, float]:
+        calendar_prices = fetch_calendar_prices_for_query(query)
+        if checkpoint:
+            checkpoint.store_calendar_prices(query, calendar_prices)
+        return calendar_prices
+
+    calendar_prices_by_query.update(zip(missing, map_concurrently(fetch, missing, workers)))
+    return {query: calendar_prices_by_query[query] for query in queries}
+
+def get_route_calendar_prices(leg: dict[str, str | list[str] | int | bool | None], calendar_prices_by_query: dict[tuple[str, str, str, str], dict[int, float]], stops: str) -> dict[tuple[str, str], dict[int, float]]:
+    dates = set(map(date_to_ordinal, leg['flights']))
+    route_calendar_prices = {}
+    for route in get_leg_routes(leg):
+        calendar_prices = {}
+        for month in leg['months']:
+            calendar_prices.update(calendar_prices_by_query[get_calendar_query(route, month, stops)])
+        route_calendar_prices[route] = {date: price for date, price in calendar_prices.items() if date in dates}
+    return route_calendar_prices
+
+def build_legs(itinerary: list[dict[str, str | list[str] | int | bool | None]], calendar_prices_by_query: dict[tuple[str, str, str, str], dict[int, float]], stops: str) -> list[Leg]:
+    return [Leg.from_dict(leg, get_route_calendar_prices(leg, calendar_prices_by_query, stops)) for leg in itinerary]
+
+def filter_itinerary_by_calendar(itinerary: list[dict[str, str | list[str] | int | bool | None]], legs: list[Leg]) -> list[dict[str, str | list[str] | int | bool | None]]:
+    return [
+        {**leg_dict, 'flights': {date: [] for date in leg_dict['flights'] if date_to_ordinal(date) in leg.calendar_prices}}
+        for leg_dict, leg in zip(itinerary, legs)
+    ]
+
+def get_flight_query(leg: Leg, route: tuple[str, str], date: int, adults: int, stops: str) -> tuple[str, str, int, int, str, str, str]:
+    return (*route, date, adults, stops, leg.min_departure_hour, leg.max_departure_hour)
+
+def get_flight_search(query: tuple[str, str, int, int, str, str, str]) -> dict[str, str | int]:
+    from_entity, to_entity, date, adults, stops, min_departure_hour, max_departure_hour = query
+    return {
+        'from_entity': from_entity,
+        'to_entity': to_entity,
+        'date': ordinal_to_date(date),
+        'adults': adults,
+        'stops': stops,
+        'min_departure_hour': min_departure_hour,
+        'max_departure_hour': max_departure_hour
+    }
+
+def get_leg_dates(legs: list[Leg]) -> list[list[int]]:
+    return prune_leg_dates([list(leg.calendar_prices) for leg in legs], [leg.stay for leg in legs[:-1]])
+
+def get_flight_requests(legs: list[Leg], adults: int, stops: str) -> list[dict[str, object]]:
+    return [
+        FlightsApi.flights_request(*route, ordinal_to_date(date), adults, stops)
+        for leg, dates in zip(legs, get_leg_dates(legs)) for date in dates for route in leg.get_routes_for_date(date)
+    ]
+
+def fetch_flights_for_query(query: tuple[str, str, int, int, str, str, str]) -> list[FlightOffer]:
+    return FlightsApi.get_instance().get_flights_for_date(**get_flight_search(query))
+
+def fetch_flights_for_queries(queries: list[tuple[str, str, int, int, str, str, str]], workers: int, use_async: bool = False, on_result: callable = None) -> dict[tuple[str, str, int, int, str, str, str], list[FlightOffer]]:
+    on_result = on_result or (lambda query, flights: None)
+    if use_async:
+        searches = asyncio.run(AsyncFlightsApi.get_instance().get_flights_for_dates(
+            list(map(get_flight_search, queries)), workers, lambda index, flights: on_result(queries[index], flights)
+        ))
+        return dict(zip(queries, searches))
+
+    def fetch(query: tuple[str, str, int, int, str, str, str]) -> list[FlightOffer]:
+        flights = fetch_flights_for_query(query)
+        on_result(query, flights)
+        return flights
+
+    return dict(zip(queries, map_concurrently(fetch, queries, workers)))
+
+def fetch_cheapest_flights_for_queries(queries: list[tuple[str, str, int, int, str, str, str]], options: PlanOptions) -> dict[tuple[str, str, int, int, str, str, str], FlightOffer | None]:
+    checkpoint = options.checkpoint
+    missing = [query for query in queries if not checkpoint or not checkpoint.has_flight(query)]
+    # Each search is checkpointed as soon as it finishes, so a crash mid batch keeps the searches already done.
+    on_result = (lambda query, flights: checkpoint.store_flight(query, get_cheapest_flight(flights) if flights else None)) if checkpoint else None
+    with instrumentation.span('flight searches'):
+        cheapest_flights = {
+            query: get_cheapest_flight(flights) if flights else None
+            for query, flights in fetch_flights_for_queries(missing, options.workers, options.use_async, on_result).items()
+        } if missing else {}
+    return {query: cheapest_flights[query] if query in cheapest_flights else checkpoint.get_flight(query) for query in queries}
+
+def fetch_cheapest_flights_for_nodes(legs: list[Leg], nodes: list[tuple[int, int]], adults: int, stops: str, options: PlanOptions) -> dict[tuple[int, int], FlightOffer | None]:
+    # Airports of a leg are searched one route per round, cheapest calendar price first, and a
+    # route is skipped once its calendar price can no longer beat the cheapest flight found.
+    cheapest_flights = dict.fromkeys(nodes)
+    pending_routes = {(index, date): legs[index].get_routes_for_date(date) for index, date in nodes}
+    while pending_routes:
+        nodes_by_query = {}
+        for (index, date), routes in list(pending_routes.items()):
+            cheapest_flight = cheapest_flights[(index, date)]
+            if not routes or (cheapest_flight and legs[index].route_calendar_prices[routes[0]][date] * adults >= cheapest_flight.price):
+                del pending_routes[(index, date)]
+                continue
+            query = get_flight_query(legs[index], routes.pop(0), date, adults, stops)
+            nodes_by_query.setdefault(query, []).append((index, date))
+        for query, flight in fetch_cheapest_flights_for_queries(list(nodes_by_query), options).items():
+            if not flight:
+                continue
+            for node in nodes_by_query[query]:
+                if cheapest_flights[node] is None or flight.price < cheapest_flights[node].price:
+                    cheapest_flights[node] = flight
+    return cheapest_flights
+
+def fetch_cheapest_flights_for_legs(legs: list[Leg], leg_dates: list[list[int]], stays: list[tuple[int, int]], adults: int, stops: str, options: PlanOptions) -> list[dict[int, FlightOffer]]:
+    cheapest_flights = []
+    for index in range(len(legs)):
+        flights_by_node = fetch_cheapest_flights_for_nodes(legs, [(index, date) for date in leg_dates[index]], adults, stops, options)
+        cheapest_flights.append({date: flight for (_, date), flight in flights_by_node.items() if flight})
+        leg_dates = prune_leg_dates(leg_dates[:index] + [list(cheapest_flights[index])] + leg_dates[index + 1:], stays)
+    return [{date: flights[date] for date in dates} for flights, dates in zip(cheapest_flights, leg_dates)]
+
+def find_cheapest_itineraries_lazily(legs: list[Leg], leg_dates: list[list[int]], stays: list[tuple[int, int]], adults: int, stops: str, options: PlanOptions, stream: ResultStream | None = None) -> tuple[list[tuple[float, list[int]]], list[dict[int, FlightOffer | None]]]:
+    # Calendar prices are per passenger while searches are priced for the whole group.
+    estimated_prices = [{date: leg.calendar_prices[date] * adults for date in dates} for leg, dates in zip(legs, leg_dates)]
+    cheapest_flights = [{} for _ in legs]
+    cheapest_itineraries = []
+    candidates = iter_cheapest_itineraries(estimated_prices, stays)
+    while batch := list(itertools.islice(candidates, options.workers)):
+        if len(cheapest_itineraries) == options.top:
+            batch = [(estimate, path) for estimate, path in batch if estimate < -cheapest_itineraries[0][0]]
+            if not batch:
+                break
+        nodes = list(dict.fromkeys((index, date) for _, path in batch for index, date in enumerate(path) if date not in cheapest_flights[index]))
+        for (index, date), flight in fetch_cheapest_flights_for_nodes(legs, nodes, adults, stops, options).items():
+            cheapest_flights[index][date] = flight
+        for _, path in batch:
+            flights = [cheapest_flights[index][date] for index, date in enumerate(path)]
+            if None in flights:
+                continue
+            total = sum(flight.price for flight in flights)
+            if stream:
+                stream.add(build_complete_itinerary(path, cheapest_flights))
+            heapq.heappush(cheapest_itineraries, (-total, path))
+            if len(cheapest_itineraries) > options.top:
+                heapq.heappop(cheapest_itineraries)
+    return sorted(((-total, path) for total, path in cheapest_itineraries), key=lambda item: item[0]), cheapest_flights
+
+def rank_itineraries(legs: list[Leg], adults: int, stops: str, options: PlanOptions, stream: ResultStream | None = None) -> list[dict[str, int | list[dict[str, str | float]]]]:
+    stays = [leg.stay for leg in legs[:-1]]
+    leg_dates = get_leg_dates(legs)
+    if options.lazy:
+        with instrumentation.span('lazy search'):
+            cheapest_itineraries, cheapest_flights = find_cheapest_itineraries_lazily(legs, leg_dates, stays, adults, stops, options, stream)
+        return [build_complete_itinerary(possible_itinerary, cheapest_flights) for _, possible_itinerary in cheapest_itineraries]
+
+    with instrumentation.span('fetch flights'):
+        cheapest_flights = fetch_cheapest_flights_for_legs(legs, leg_dates, stays, adults, stops, options)
+    complete_itineraries = []
+    with instrumentation.span('rank'):
+        leg_prices = [{date: flight.price for date, flight in flights.items()} for flights in cheapest_flights]
+        if options.engine == 'numpy':
+            cheapest_itineraries = find_cheapest_itineraries(leg_prices, stays, options.top)
+        else:
+            cheapest_itineraries = itertools.islice(iter_cheapest_itineraries(leg_prices, stays), options.top)
+        for _, possible_itinerary in cheapest_itineraries:
+            complete_itineraries.append(build_complete_itinerary(possible_itinerary, cheapest_flights))
+            if stream:
+                stream.add(complete_itineraries[-1])
+    return complete_itineraries
+
+def build_complete_itinerary(possible_itinerary: list[int], cheapest_flights: list[dict[int, FlightOffer]]) -> dict[str, int | list[dict[str, str | float]]]:
+    complete_itinerary = {'total': None, 'legs': []}
+    for index, date in enumerate(possible_itinerary):
+        flight = cheapest_flights[index][date]
+        complete_itinerary['legs'].append({
+            'fromEntityId': flight.from_entity,
+            'toEntityId': flight.to_entity,
+            'date': ordinal_to_date(date),
+            'price': flight.price,
+            'departure': flight.departure,
+            'arrival': flight.arrival
+        })
+    complete_itinerary['total'] = int(sum(map(lambda leg: leg['price'], complete_itinerary['legs'])))
+    return complete_itinerary
+
+def get_cheapest_flight(flights: list[FlightOffer]) -> FlightOffer:
+    return min(flights, key=lambda flight: flight.price)
+
+def get_variants(adults_options: list[int], stops_options: list[str]) -> list[tuple[int, str]]:
+    return list(itertools.product(adults_options, stops_options))
+
+def get_variant_path(path: str, suffix: str | None) -> str:
+    if not suffix:
+        return path
+    name, extension = path.rsplit('.', 1)
+    return f'{name}_{suffix}.{extension}'
+
+def get_variant_suffix(adults: int, stops: str, variants: list[tuple[int, str]]) -> str | None:
+    if len(variants) == 1:
+        return None
+    return f'{adults}_adults_{stops.replace(",", "+")}'
+
+def rank_variant(legs: list[Leg], adults: int, stops: str, options: PlanOptions, suffix: str | None, output_path: str = 'final_result.json') -> list[dict[str, int | list[dict[str, str | float]]]]:
+    # Results depend on how they were ranked, not only on the searched flights.
+    checkpoint_key = (adults, stops, options.top, options.lazy, options.engine)
+    if options.checkpoint and (complete_itineraries := options.checkpoint.get_results(checkpoint_key)) is not None:
+        return complete_itineraries
+    if not options.stream:
+        complete_itineraries = rank_itineraries(legs, adults, stops, options)
+    else:
+        stream = ResultStream(get_variant_path(output_path, suffix), options.top, f'{adults} adults, {stops}' if suffix else 'Results')
+        try:
+            complete_itineraries = rank_itineraries(legs, adults, stops, options, stream)
+        finally:
+            stream.close()
+    if options.checkpoint:
+        options.checkpoint.store_results(checkpoint_key, complete_itineraries)
+    return complete_itineraries
+
+def rank_variants(legs_by_stops: dict[str, list[Leg]], variants: list[tuple[int, str]], options: PlanOptions, output_path: str = 'final_result.json') -> dict[tuple[int, str], list[dict[str, int | list[dict[str, str | float]]]]]:
+    results = map_concurrently(lambda variant: rank_variant(legs_by_stops[variant[1]], *variant, options, get_variant_suffix(*variant, variants), output_path), variants, len(variants))
+    return dict(zip(variants, results))
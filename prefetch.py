@@ -0,0 +1,162 @@
+import argparse
+import calendar
+import itertools
+import json
+import os
+from datetime import date, datetime, timedelta
+from cache import CacheManager, SqliteCacheBackend
+from flights_api import FlightsApi
+from helper_functions import GREEN, YELLOW, print_colored, error, map_concurrently, to_list
+from arguments import add_client_arguments, validate_client_arguments
+from instrumentation import instrumentation
+from main import use_cache, get_client_options
+
+def get_watchlist_requests(watchlist: list[dict[str, object]], today: date) -> list[dict[str, object]]:
+    requests = []
+    for entry in watchlist:
+        for from_entity, to_entity in itertools.product(to_list(entry['fromEntityId']), to_list(entry['toEntityId'])):
+            for year_month in entry['months']:
+                year, month = map(int, year_month.split('-'))
+                if (year, month) < (today.year, today.month):
+                    continue
+                requests.append(FlightsApi.calendar_request(from_entity, to_entity, month, year))
+                if not entry.get('flights'):
+                    continue
+                for day in range(1, calendar.monthrange(year, month)[1] + 1):
+                    if date(year, month, day) < today:
+                        continue
+                    for adults, stops in itertools.product(to_list(entry.get('adults', [1])), to_list(entry.get('stops', ['direct']))):
+                        requests.append(FlightsApi.flights_request(from_entity, to_entity, date(year, month, day).isoformat(), adults, stops))
+    return requests
+
+def get_learned_requests(history_days: int, today: date) -> list[dict[str, object]]:
+    backend = CacheManager.get_backend()
+    if not isinstance(backend, SqliteCacheBackend):
+        error('Learning the watchlist needs the access history of --cache-backend sqlite')
+    requests = []
+    # Most read entries first, so a small budget still keeps the popular routes warm.
+    for subdir, _, params, _ in backend.get_accessed_entries(datetime.now() - timedelta(days=history_days)):
+        if subdir == 'calendar':
+            year, month = map(int, params['yearMonth'].split('-'))
+            if (year, month) >= (today.year, today.month):
+                requests.append(FlightsApi.calendar_request(params['fromEntityId'], params['toEntityId'], month, year))
+        elif subdir == 'flights' and date.fromisoformat(params['departDate']) >= today:
+            requests.append(FlightsApi.flights_request(params['fromEntityId'], params['toEntityId'], params['departDate'], params['adults'], params['stops']))
+    return requests
+
+def is_due(request: dict[str, object], refresh_before: timedelta) -> bool:
+    expires_at = CacheManager.get_expires_at(request['cache_subdir'], request['endpoint'], request['params'])
+    return expires_at is None or expires_at - datetime.now() <= refresh_before
+
+def get_spent_requests() -> int:
+    return sum(counters['requests'] for counters in instrumentation.summary()['endpoints'].values())
+
+def refresh(request: dict[str, object], budget: int) -> bool:
+    if get_spent_requests() >= budget:
+        return False
+    FlightsApi.get_instance().send_api_request(**request, refresh=True)
+    return True
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Refresh cached calendars and flight searches before they expire, so planning runs find a warm cache')
+    parser.add_argument(
+        '--watchlist',
+        dest='watchlist',
+        help="""
+        JSON list of routes to keep warm, each with fromEntityId and toEntityId (a skyId or a list of them),
+        months as YYYY-MM and optionally "flights": true with adults and stops to refresh every day's searches too
+        ex: --watchlist watchlist.json
+        """
+    )
+    parser.add_argument(
+        '--learn',
+        dest='learn',
+        action='store_true',
+        help="""
+        Also refresh the calendars and searches read from the cache in the last --history-days, most read first
+        ex: --learn
+        """
+    )
+    parser.add_argument(
+        '--history-days',
+        dest='history_days',
+        type=int,
+        default=14,
+        help="""
+        How far back --learn looks at cache reads
+        ex: --history-days 30
+        """
+    )
+    parser.add_argument(
+        '--refresh-before',
+        dest='refresh_before',
+        type=float,
+        default=24,
+        help="""
+        Refresh entries expiring within this many hours, missing entries are always fetched
+        ex: --refresh-before 12
+        """
+    )
+    parser.add_argument(
+        '--budget',
+        dest='budget',
+        type=int,
+        default=100,
+        help="""
+        Number of API requests after which no new entry is refreshed, polling included
+        (refreshes already running, at most --workers, still finish)
+        ex: --budget 500
+        """
+    )
+    parser.add_argument(
+        '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        help="""
+        Only report how many entries are due
+        ex: --dry-run
+        """
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=4,
+        help="""
+        Maximum number of entries refreshed concurrently
+        ex: --workers 2
+        """
+    )
+    add_client_arguments(parser, requests_per_second=1)
+    args = parser.parse_args()
+    if not args.watchlist and not args.learn:
+        parser.error('Use --watchlist, --learn or both')
+    if args.watchlist and not os.path.isfile(args.watchlist):
+        parser.error(f'File not found: {args.watchlist}')
+    if args.budget < 1:
+        parser.error(f'--budget argument({args.budget}) must be at least 1')
+    if args.workers < 1:
+        parser.error(f'--workers argument({args.workers}) must be at least 1')
+    validate_client_arguments(parser, args)
+    return args
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    use_cache(args)
+    today = date.today()
+    requests = []
+    if args.watchlist:
+        with open(args.watchlist) as f:
+            requests += get_watchlist_requests(json.load(f), today)
+    if args.learn:
+        requests += get_learned_requests(args.history_days, today)
+    requests = list({(request['endpoint'], CacheManager.get_key(request['params'])): request for request in requests}.values())
+    # Calendars first: one request covers a whole month of dates for the planner.
+    due = sorted((request for request in requests if is_due(request, timedelta(hours=args.refresh_before))), key=lambda request: request['cache_subdir'] != 'calendar')
+    print_colored(GREEN, f'{len(due)} of {len(requests)} watched entries are missing or expire within {args.refresh_before:g} hours')
+    if due and not args.dry_run:
+        FlightsApi.get_instance(**get_client_options(args))
+        instrumentation.reset()
+        refreshed = sum(map_concurrently(lambda request: refresh(request, args.budget), due, args.workers))
+        color = GREEN if refreshed == len(due) else YELLOW
+        print_colored(color, f'Refreshed {refreshed} of {len(due)} due entries with {get_spent_requests()} API requests (budget {args.budget})')
@@ -0,0 +1,48 @@
+from helper_functions import error
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def find_cheapest_itineraries(leg_prices: list[dict[int, float]], stays: list[tuple[int, int]], top: int) -> list[tuple[float, list[int]]]:
+    if np is None:
+        error('NumPy is required for --engine numpy', 'Install it with: pip install numpy')
+    if not all(leg_prices):
+        return []
+
+    first_date = min(min(prices) for prices in leg_prices)
+    days = max(max(prices) for prices in leg_prices) - first_date + 1
+    price_matrix = np.full((len(leg_prices), days), np.inf)
+    for index, prices in enumerate(leg_prices):
+        price_matrix[index, np.fromiter(prices, dtype=np.int64) - first_date] = np.fromiter(prices.values(), dtype=np.float64)
+
+    # cheapest[index][day, rank] is the rank-th cheapest total from that leg and day to the end of the trip
+    # and choices[index][day, rank] the column of the next leg's candidates it continues with.
+    cheapest = [None] * len(leg_prices)
+    choices = [None] * len(leg_prices)
+    cheapest[-1] = np.full((days, top), np.inf)
+    cheapest[-1][:, 0] = price_matrix[-1]
+    for index in reversed(range(len(stays))):
+        min_stay_duration, max_stay_duration = stays[index]
+        candidates = np.full((days, (max_stay_duration - min_stay_duration + 1) * top), np.inf)
+        for window, duration in enumerate(range(min_stay_duration, max_stay_duration + 1)):
+            if duration < days:
+                candidates[:days - duration, window * top:(window + 1) * top] = cheapest[index + 1][duration:]
+        order = np.argsort(candidates, axis=1, kind='stable')[:, :top]
+        cheapest[index] = price_matrix[index][:, None] + np.take_along_axis(candidates, order, axis=1)
+        choices[index] = order
+
+    totals = cheapest[0].ravel()
+    cheapest_itineraries = []
+    for position in np.argsort(totals, kind='stable')[:top]:
+        if not np.isfinite(totals[position]):
+            break
+        day, rank = divmod(int(position), top)
+        path = [first_date + day]
+        for index, (min_stay_duration, _) in enumerate(stays):
+            window, rank = divmod(int(choices[index][day, rank]), top)
+            day += min_stay_duration + window
+            path.append(first_date + day)
+        cheapest_itineraries.append((float(totals[position]), path))
+    return cheapest_itineraries
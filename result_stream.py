@@ -0,0 +1,46 @@
+import heapq
+import json
+import threading
+import time
+from helper_functions import GREEN, print_colored, write_json_atomically
+
+class ResultStream:
+    def __init__(self, path: str, top: int, label: str = 'Results', flush_interval: float = 2):
+        self.path = path
+        self.top = top
+        self.label = label
+        self.flush_interval = flush_interval
+        # Bounded max-heap of (-total, -sequence, itinerary): the most expensive, latest found result is popped first.
+        self.heap: list[tuple[int, int, dict[str, int | list[dict[str, str | float]]]]] = []
+        self.found = 0
+        self.lock = threading.Lock()
+        name, _ = path.rsplit('.', 1)
+        self.lines = open(f'{name}.jsonl', 'w')
+        self.flushed_at = time.monotonic()
+
+    def add(self, itinerary: dict[str, int | list[dict[str, str | float]]]) -> None:
+        with self.lock:
+            self.found += 1
+            self.lines.write(json.dumps(itinerary) + '\n')
+            self.lines.flush()
+            heapq.heappush(self.heap, (-itinerary['total'], -self.found, itinerary))
+            if len(self.heap) > self.top:
+                heapq.heappop(self.heap)
+            if time.monotonic() - self.flushed_at >= self.flush_interval:
+                self._flush()
+
+    def results(self) -> list[dict[str, int | list[dict[str, str | float]]]]:
+        return [itinerary for _, _, itinerary in sorted(self.heap, reverse=True)]
+
+    def _flush(self) -> None:
+        results = self.results()
+        write_json_atomically(self.path, results, indent=4)
+        best = f'best so far {results[0]["total"]}' if results else 'none yet'
+        print_colored(GREEN, f'{self.label}: {self.found} itineraries found, {best}')
+        self.flushed_at = time.monotonic()
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.lines.closed:
+                self._flush()
+                self.lines.close()
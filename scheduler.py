@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator
+from email.utils import parsedate_to_datetime
+import requests
+from helper_functions import logging, error, get_backoff_delay, write_json_atomically
+from instrumentation import instrumentation
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        # Every thread sharing the bucket waits, and refilling starts over once the pause ends.
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated_at = self.paused_until
+
+class QuotaCounter:
+    def __init__(self, path: str, monthly_quota: int | None = None):
+        self.path = path
+        self.monthly_quota = monthly_quota
+        self.lock = threading.Lock()
+        self.used_by_month = self.load()
+
+    @staticmethod
+    def get_month() -> str:
+        return datetime.now().strftime('%Y-%m')
+
+    def load(self) -> dict[str, int]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @contextmanager
+    def file_lock(self) -> Iterator[None]:
+        # Other clients and processes (server, prefetch) count into the same file.
+        os.makedirs(os.path.dirname(self.path), mode=0o750, exist_ok=True)
+        with open(f'{self.path}.lock', 'w') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def used(self) -> int:
+        with self.lock:
+            self.used_by_month = self.load()
+            return self.used_by_month.get(self.get_month(), 0)
+
+    def remaining(self) -> int | None:
+        return None if self.monthly_quota is None else max(0, self.monthly_quota - self.used())
+
+    def increment(self) -> None:
+        with self.lock, self.file_lock():
+            self.used_by_month = self.load()
+            used = self.used_by_month.get(self.get_month(), 0)
+            if self.monthly_quota is not None and used >= self.monthly_quota:
+                error(f'The monthly quota of {self.monthly_quota} requests is used up', 'Raise --monthly-quota if your plan allows more requests')
+            self.used_by_month[self.get_month()] = used + 1
+            write_json_atomically(self.path, self.used_by_month)
+
+class RequestScheduler:
+    def __init__(self, quota_path: str, requests_per_second: float = 5, monthly_quota: int | None = None, max_retries: int = 5):
+        self.bucket = TokenBucket(requests_per_second)
+        self.quota = QuotaCounter(quota_path, monthly_quota)
+        self.max_retries = max_retries
+
+    @staticmethod
+    def get_retry_after(response: requests.Response) -> float | None:
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        try:
+            return max(0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+
+    def send(self, request: callable, endpoint: str = '') -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self.quota.increment()
+            response = request()
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+            retry_after = self.get_retry_after(response)
+            delay = get_backoff_delay(attempt) if retry_after is None else retry_after
+            instrumentation.increment(endpoint, 'retries')
+            logging.warning(f'Got HTTP {response.status_code}, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})')
+            if response.status_code == 429 or retry_after is not None:
+                # The API limits the whole client, so the other workers back off too; the next acquire waits for the pause.
+                self.bucket.pause(delay)
+            else:
+                time.sleep(delay)
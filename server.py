@@ -0,0 +1,177 @@
+import argparse
+import copy
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flights_api import FlightsApi
+from helper_functions import GREEN, print_colored, to_list, is_whole_number, get_variant_options_error, validate_date_format, is_date_greater_or_equal, increase_date_by_days, convert_string_to_time
+from arguments import add_client_arguments, validate_client_arguments
+from instrumentation import instrumentation
+from main import use_cache, get_client_options
+from models import PlanOptions
+from planner import mutate_itinerary_with_possible_flight_dates, get_calendar_queries, fetch_calendar_prices, build_legs, get_variants, rank_variants
+
+class PlanRequestError(ValueError):
+    pass
+
+def parse_plan_request(body: dict[str, object], workers: int) -> tuple[list[dict[str, object]], str, str, list[int], list[str], PlanOptions]:
+    itinerary = body.get('itinerary')
+    if not isinstance(itinerary, list) or not itinerary:
+        raise PlanRequestError('itinerary must be a non empty list of legs')
+    for index, leg in enumerate(itinerary):
+        if not isinstance(leg, dict):
+            raise PlanRequestError(f'itinerary leg {index} must be a JSON object')
+        missing = {'fromEntityId', 'toEntityId', 'min_stay_duration', 'max_stay_duration'} - set(leg)
+        if missing:
+            raise PlanRequestError(f'itinerary leg {index} is missing {", ".join(sorted(missing))}')
+        for key in 'fromEntityId', 'toEntityId':
+            if not leg[key] or not all(isinstance(entity, str) and entity for entity in to_list(leg[key])):
+                raise PlanRequestError(f'itinerary leg {index} {key} must be a skyId or a list of skyIds')
+        final_leg = index == len(itinerary) - 1
+        for key in 'min_stay_duration', 'max_stay_duration':
+            stay = leg[key]
+            if stay is None and final_leg:
+                continue
+            if not is_whole_number(stay) or stay < 0:
+                raise PlanRequestError(f'itinerary leg {index} {key} must be a whole number of days' + ('' if final_leg else ', only the final leg can be null'))
+        if None not in (leg['min_stay_duration'], leg['max_stay_duration']) and leg['min_stay_duration'] > leg['max_stay_duration']:
+            raise PlanRequestError(f'itinerary leg {index} min_stay_duration is greater than max_stay_duration')
+        leg.setdefault('min_departure_hour', '00:00:00')
+        leg.setdefault('max_departure_hour', '23:59:59')
+        for key in 'min_departure_hour', 'max_departure_hour':
+            if not isinstance(leg[key], str) or not validate_date_format(leg[key], '%H:%M:%S'):
+                raise PlanRequestError(f'itinerary leg {index} {key} must be a time in format "HH:MM:SS"')
+        if convert_string_to_time(leg['min_departure_hour'], '%H:%M:%S') >= convert_string_to_time(leg['max_departure_hour'], '%H:%M:%S'):
+            raise PlanRequestError(f'itinerary leg {index} min_departure_hour must be earlier than max_departure_hour')
+
+    start_date, end_date = body.get('leave'), body.get('return')
+    for date in start_date, end_date:
+        if not isinstance(date, str) or not validate_date_format(date, '%Y-%m-%d'):
+            raise PlanRequestError(f'{date} does not respect the correct format "YYYY-MM-DD"')
+        if not is_date_greater_or_equal(date):
+            raise PlanRequestError(f'Invalid date: {date}. Please enter a date that is today or in the future.')
+    if not is_date_greater_or_equal(end_date, start_date):
+        raise PlanRequestError(f'return({end_date}) is earlier than leave({start_date})')
+    if not is_date_greater_or_equal(end_date, increase_date_by_days(start_date, sum(leg['max_stay_duration'] or 0 for leg in itinerary))):
+        raise PlanRequestError('The max holiday duration exceeds the interval of days between leave and return')
+
+    adults_options = to_list(body.get('adults', [1]))
+    stops_options = to_list(body.get('stops', ['direct']))
+    if message := get_variant_options_error(adults_options, stops_options):
+        raise PlanRequestError(message)
+    options = PlanOptions(top=body.get('top', 10), workers=workers, lazy=body.get('lazy', False), engine=body.get('engine', 'search'))
+    if not is_whole_number(options.top) or options.top < 1:
+        raise PlanRequestError('top must be a whole number of at least 1')
+    if not isinstance(options.lazy, bool):
+        raise PlanRequestError('lazy must be true or false')
+    if options.engine not in ('search', 'numpy'):
+        raise PlanRequestError('engine must be search or numpy')
+    if options.lazy and options.engine == 'numpy':
+        raise PlanRequestError('engine numpy cannot be combined with lazy, the lazy search ranks while it searches')
+    return itinerary, start_date, end_date, adults_options, stops_options, options
+
+def plan(body: dict[str, object], workers: int) -> list[dict[str, object]]:
+    itinerary, start_date, end_date, adults_options, stops_options, options = parse_plan_request(copy.deepcopy(body), workers)
+    with instrumentation.span('plan'):
+        mutate_itinerary_with_possible_flight_dates(itinerary, start_date, end_date)
+        calendar_prices_by_query = fetch_calendar_prices(get_calendar_queries(itinerary, stops_options), workers)
+        legs_by_stops = {stops: build_legs(itinerary, calendar_prices_by_query, stops) for stops in stops_options}
+        results = rank_variants(legs_by_stops, get_variants(adults_options, stops_options), options)
+    return [{'adults': adults, 'stops': stops, 'itineraries': itineraries} for (adults, stops), itineraries in results.items()]
+
+class PlannerRequestHandler(BaseHTTPRequestHandler):
+    workers = 8
+
+    def send_json(self, status: int, data: object) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            flights_api = FlightsApi.get_instance()
+            self.send_json(200, {
+                **instrumentation.summary(),
+                'memoized': {
+                    'flights': flights_api.get_flights_for_date.cache.stats(),
+                    'calendars': flights_api.get_flight_prices_by_route.cache.stats()
+                }
+            })
+        else:
+            self.send_json(404, {'error': f'Unknown path: {self.path}'})
+
+    def do_POST(self) -> None:
+        if self.path != '/plan':
+            self.send_json(404, {'error': f'Unknown path: {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(body, dict):
+                raise PlanRequestError('The request body must be a JSON object')
+            self.send_json(200, {'results': plan(body, self.workers)})
+        except (json.JSONDecodeError, PlanRequestError) as e:
+            self.send_json(400, {'error': str(e)})
+        except SystemExit:
+            # error() exits the process in the CLI, here it only ends this plan.
+            self.send_json(502, {'error': 'The flights API could not complete the plan, see the server log'})
+        except Exception:
+            logging.exception('Planning failed')
+            self.send_json(500, {'error': 'Planning failed, see the server log'})
+
+    def log_message(self, format: str, *args) -> None:
+        logging.info(f'{self.address_string()} - {format % args}')
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Serve itinerary plans over HTTP, keeping the flights API client and caches warm between plans')
+    parser.add_argument(
+        '--host',
+        dest='host',
+        default='127.0.0.1',
+        help="""
+        Address to listen on
+        ex: --host 0.0.0.0
+        """
+    )
+    parser.add_argument(
+        '--port',
+        dest='port',
+        type=int,
+        default=8000,
+        help="""
+        Port to listen on
+        ex: --port 8080
+        """
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=8,
+        help="""
+        Maximum number of flight searches fetched concurrently by each plan
+        ex: --workers 4
+        """
+    )
+    add_client_arguments(parser)
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error(f'--workers argument({args.workers}) must be at least 1')
+    validate_client_arguments(parser, args)
+    return args
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    use_cache(args)
+    FlightsApi.get_instance(**get_client_options(args))
+    PlannerRequestHandler.workers = args.workers
+    server = ThreadingHTTPServer((args.host, args.port), PlannerRequestHandler)
+    print_colored(GREEN, f'Planning on http://{args.host}:{args.port}/plan')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()